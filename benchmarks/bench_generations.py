@@ -0,0 +1,254 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Benchmarks for evolve() and the traversal utilities.
+
+The benchmarks use pyperf and synthetic databases built from scratch
+(``pip install -e .[test] pyperf``).  Run them and compare two runs like this::
+
+  $ python benchmarks/bench_generations.py -o before.json
+  $ python benchmarks/bench_generations.py -o after.json
+  $ python -m pyperf compare_to before.json after.json
+
+Use ``--storage file`` to benchmark a FileStorage instead of a
+MappingStorage and ``--fanout``, ``--depth``, ``--managers`` and
+``--steps`` to change the size of the databases.  The traversal
+benchmarks report the time per object; its inverse is the throughput in
+objects per second.
+"""
+import os
+import shutil
+import tempfile
+
+import pyperf
+import transaction
+import zope.component
+import zope.interface
+from persistent.mapping import PersistentMapping
+
+from zope.generations.generations import evolve
+from zope.generations.interfaces import ISchemaManager
+from zope.generations.utility import findObjectsMatching
+from zope.generations.utility import findObjectsProviding
+from zope.generations.utility import findOidsByClass
+
+
+class IMarker(zope.interface.Interface):
+    pass
+
+
+class Container(PersistentMapping):
+    pass
+
+
+@zope.interface.implementer(IMarker)
+class MarkedContainer(PersistentMapping):
+    pass
+
+
+@zope.interface.implementer(ISchemaManager)
+class Manager:
+
+    minimum_generation = 0
+
+    def __init__(self, generation=0):
+        self.generation = generation
+
+    def evolve(self, context, generation):
+        context.connection.root()['benchmark'] = generation
+
+    def getInfo(self, generation):
+        return None
+
+
+class Database:
+    """A database of the configured storage, removed when closed."""
+
+    def __init__(self, storage):
+        self.directory = None
+        if storage == 'file':
+            from ZODB import DB
+            from ZODB.FileStorage import FileStorage
+            self.directory = tempfile.mkdtemp()
+            self.db = DB(FileStorage(os.path.join(self.directory, 'Data.fs')))
+        else:
+            from ZODB.MappingStorage import DB
+            self.db = DB()
+
+    def close(self):
+        self.db.close()
+        if self.directory is not None:
+            shutil.rmtree(self.directory)
+
+
+def registerManagers(managers):
+    registry = zope.component.getGlobalSiteManager()
+    for name, manager in managers.items():
+        registry.registerUtility(manager, ISchemaManager, name=name)
+
+
+def unregisterManagers(managers):
+    registry = zope.component.getGlobalSiteManager()
+    for name, manager in managers.items():
+        registry.unregisterUtility(manager, ISchemaManager, name=name)
+
+
+def buildTree(db, fanout, depth):
+    """Build a tree of containers, half of them marked, and count them."""
+    conn = db.open()
+    count = 0
+    with transaction.manager:
+        nodes = [conn.root()]
+        for level in range(depth):
+            children = []
+            for node in nodes:
+                for i in range(fanout):
+                    factory = MarkedContainer if i % 2 else Container
+                    node[i] = child = factory()
+                    children.append(child)
+            count += len(children)
+            nodes = children
+            transaction.savepoint(optimistic=True)
+    conn.close()
+    return count
+
+
+def timeEvolveNoop(loops, args, cache_file):
+    managers = {'manager%d' % i: Manager() for i in range(args.managers)}
+    registerManagers(managers)
+    database = Database(args.storage)
+    try:
+        # Install and record the cache entry.
+        for _ in range(2):
+            evolve(database.db, cache_file=cache_file)
+        t0 = pyperf.perf_counter()
+        for _ in range(loops):
+            evolve(database.db, cache_file=cache_file)
+        return pyperf.perf_counter() - t0
+    finally:
+        database.close()
+        unregisterManagers(managers)
+
+
+def timeEvolveSteps(loops, args, squash):
+    manager = Manager()
+    managers = {'manager': manager}
+    registerManagers(managers)
+    database = Database(args.storage)
+    try:
+        evolve(database.db)
+        duration = 0
+        for _ in range(loops):
+            manager.generation += args.steps
+            t0 = pyperf.perf_counter()
+            evolve(database.db, squash=squash)
+            duration += pyperf.perf_counter() - t0
+        return duration
+    finally:
+        database.close()
+        unregisterManagers(managers)
+
+
+def timeTraversal(loops, args, find):
+    database = Database(args.storage)
+    try:
+        buildTree(database.db, args.fanout, args.depth)
+        conn = database.db.open()
+        duration = 0
+        with transaction.manager:
+            for _ in range(loops):
+                conn.cacheMinimize()
+                t0 = pyperf.perf_counter()
+                for _ in find(conn.root()):
+                    pass
+                duration += pyperf.perf_counter() - t0
+        conn.close()
+        return duration
+    finally:
+        database.close()
+
+
+def timeFindOidsByClass(loops, args):
+    database = Database(args.storage)
+    try:
+        buildTree(database.db, args.fanout, args.depth)
+        name = MarkedContainer.__module__ + '.MarkedContainer'
+        t0 = pyperf.perf_counter()
+        for _ in range(loops):
+            for _ in findOidsByClass(database.db.storage, name):
+                pass
+        return pyperf.perf_counter() - t0
+    finally:
+        database.close()
+
+
+def addCommandLineArgs(cmd, args):
+    cmd.extend(('--storage', args.storage,
+                '--fanout', str(args.fanout),
+                '--depth', str(args.depth),
+                '--managers', str(args.managers),
+                '--steps', str(args.steps)))
+
+
+def main():
+    runner = pyperf.Runner(add_cmdline_args=addCommandLineArgs)
+    runner.argparser.add_argument(
+        '--storage', choices=('mapping', 'file'), default='mapping')
+    runner.argparser.add_argument('--fanout', type=int, default=20)
+    runner.argparser.add_argument('--depth', type=int, default=3)
+    runner.argparser.add_argument('--managers', type=int, default=20)
+    runner.argparser.add_argument('--steps', type=int, default=20)
+    args = runner.parse_args()
+    runner.metadata['storage'] = args.storage
+
+    cache_directory = tempfile.mkdtemp()
+    try:
+        runner.bench_time_func(
+            'evolve-noop-%d-managers' % args.managers,
+            timeEvolveNoop, args, None)
+        runner.bench_time_func(
+            'evolve-noop-%d-managers-cache-file' % args.managers,
+            timeEvolveNoop, args, os.path.join(cache_directory, 'cache'))
+    finally:
+        shutil.rmtree(cache_directory)
+
+    runner.bench_time_func(
+        'evolve-step', timeEvolveSteps, args, False,
+        inner_loops=args.steps)
+    runner.bench_time_func(
+        'evolve-step-squashed', timeEvolveSteps, args, True,
+        inner_loops=args.steps)
+
+    objects = sum(args.fanout ** level for level in range(1, args.depth + 1))
+    # The root is visited, too.
+    objects += 1
+    runner.bench_time_func(
+        'find-objects-matching', timeTraversal, args,
+        lambda root: findObjectsMatching(root, lambda obj: False),
+        inner_loops=objects)
+    runner.bench_time_func(
+        'find-objects-matching-prefetch', timeTraversal, args,
+        lambda root: findObjectsMatching(
+            root, lambda obj: False, prefetch=100),
+        inner_loops=objects)
+    runner.bench_time_func(
+        'find-objects-providing', timeTraversal, args,
+        lambda root: findObjectsProviding(root, IMarker),
+        inner_loops=objects)
+    runner.bench_time_func(
+        'find-oids-by-class', timeFindOidsByClass, args,
+        inner_loops=objects)
+
+
+if __name__ == '__main__':
+    main()
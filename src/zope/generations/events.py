@@ -0,0 +1,87 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Events notified while evolving databases."""
+import zope.interface
+
+from .interfaces import IEvolutionFinished
+from .interfaces import IEvolutionStarted
+from .interfaces import IEvolutionStepFinished
+from .interfaces import IEvolutionStepProgress
+from .interfaces import IEvolutionStepStarted
+from .interfaces import IInstallFinished
+from .interfaces import IInstallStarted
+
+
+@zope.interface.implementer(IEvolutionStarted)
+class EvolutionStarted:
+
+    def __init__(self, database, how):
+        self.database = database
+        self.how = how
+
+
+@zope.interface.implementer(IEvolutionFinished)
+class EvolutionFinished(EvolutionStarted):
+
+    def __init__(self, database, how, wall_time, cpu_time, error=None):
+        super().__init__(database, how)
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.error = error
+
+
+@zope.interface.implementer(IEvolutionStepStarted)
+class EvolutionStepStarted:
+
+    def __init__(self, database, key, manager, generation):
+        self.database = database
+        self.key = key
+        self.manager = manager
+        self.generation = generation
+
+
+@zope.interface.implementer(IEvolutionStepProgress)
+class EvolutionStepProgress(EvolutionStepStarted):
+
+    def __init__(self, database, key, manager, generation, done, total,
+                 rate, eta):
+        super().__init__(database, key, manager, generation)
+        self.done = done
+        self.total = total
+        self.rate = rate
+        self.eta = eta
+
+
+@zope.interface.implementer(IEvolutionStepFinished)
+class EvolutionStepFinished(EvolutionStepStarted):
+
+    def __init__(self, database, key, manager, generation, wall_time,
+                 cpu_time, objects=None, size=None, retries=0, error=None):
+        super().__init__(database, key, manager, generation)
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.objects = objects
+        self.size = size
+        self.retries = retries
+        self.error = error
+
+
+@zope.interface.implementer(IInstallStarted)
+class InstallStarted(EvolutionStepStarted):
+    pass
+
+
+@zope.interface.implementer(IInstallFinished)
+class InstallFinished(EvolutionStepFinished):
+    pass
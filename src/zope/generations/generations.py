@@ -12,25 +12,72 @@
 #
 ##############################################################################
 """Support for application database generations."""
+import atexit
+import collections
+import concurrent.futures
+import cProfile
+import hashlib
+import heapq
+import json
 import logging
-
+import os
+import random
+import socket
+import threading
+import time
+import tracemalloc
+
+import persistent
+import persistent.mapping
 import transaction
+import transaction.interfaces
 import zope.component
+import zope.event
 import zope.interface
 
+from . import events
+from .interfaces import GenerationError
 from .interfaces import GenerationTooHigh
 from .interfaces import GenerationTooLow
+from .interfaces import IBatchSchemaManager
+from .interfaces import IDependentSchemaManager
 from .interfaces import IInstallableSchemaManager
+from .interfaces import ILazySchemaManager
 from .interfaces import ISchemaManager
+from .interfaces import ISquashableSchemaManager
+from .interfaces import IStateSchemaManager
+from .interfaces import IValidatingSchemaManager
 from .interfaces import UnableToEvolve
 
 
 logger = logging.getLogger('zope.generations')
 old_generations_key = 'zope.app.generations'
 generations_key = 'zope.generations'
-
-
-@zope.interface.implementer(IInstallableSchemaManager)
+#: The root key of the mapping holding the cursors committed by
+#: `Context.checkpoint` for unfinished evolution steps.
+progress_key = 'zope.generations.progress'
+#: The environment variable naming the default *cache_file* for `evolve`.
+cache_file_variable = 'ZOPE_GENERATIONS_CACHE_FILE'
+#: The environment variable naming the default directory for the
+#: profiles written by `evolve`.
+profile_dir_variable = 'ZOPE_GENERATIONS_PROFILE_DIR'
+#: If this environment variable is set to a non-empty value, `evolve`
+#: traces memory allocations when profiling.
+trace_memory_variable = 'ZOPE_GENERATIONS_TRACE_MEMORY'
+#: The root key of the `EvolutionLease` taken by `evolve` if asked to.
+lease_key = 'zope.generations.lease'
+#: The environment variable holding the default lease duration of
+#: `evolve`, in seconds.
+lease_duration_variable = 'ZOPE_GENERATIONS_LEASE_DURATION'
+#: The environment variable holding the number of seconds
+#: `evolveInBackgroundSubscriber` waits between evolution steps.
+step_delay_variable = 'ZOPE_GENERATIONS_STEP_DELAY'
+
+
+@zope.interface.implementer(IInstallableSchemaManager,
+                            IValidatingSchemaManager,
+                            IBatchSchemaManager,
+                            IStateSchemaManager)
 class SchemaManager:
     """Schema manager
 
@@ -83,6 +130,39 @@ class SchemaManager:
          >>> manager.getInfo(3) is None
          True
 
+       The evolvers are imported once and then kept by the manager.
+       Before evolving a database, `evolve` asks the manager to make
+       sure all of the evolvers needed exist:
+
+         >>> manager.validate(1, 3)
+         >>> manager.validate(2, 4)
+         Traceback (most recent call last):
+         ModuleNotFoundError: No module named 'zope.generations.demo.evolve4'
+
+       Passing a true *preload* imports all existing evolvers right away:
+
+         >>> manager = SchemaManager(1, 3, 'zope.generations.demo',
+         ...                         preload=True)
+         >>> sorted(manager._evolvers)
+         [1, 2, 3]
+
+       Instead of an ``evolve`` function, an evolver may provide a
+       function ``transform`` that evolves a single object.  `evolve`
+       then applies the transforms of consecutive generations in a
+       single pass over the database.  The other evolvers have no
+       transform:
+
+         >>> manager.getTransform(2) is None
+         True
+
+       An evolver may also provide a dictionary ``state_transforms``
+       mapping class names to functions changing the states of the
+       objects of the classes, see `IStateSchemaManager`.  The demo
+       evolvers don't:
+
+         >>> manager.getStateTransforms(2) is None
+         True
+
        If a package provides an install script, then it will be called
        when the manager's intall method is called:
 
@@ -123,7 +203,8 @@ class SchemaManager:
 
        """
 
-    def __init__(self, minimum_generation=0, generation=0, package_name=None):
+    def __init__(self, minimum_generation=0, generation=0, package_name=None,
+                 preload=False):
         if generation < minimum_generation:
             raise ValueError("generation is less than minimum_generation",
                              generation, minimum_generation)
@@ -138,14 +219,52 @@ class SchemaManager:
         self.minimum_generation = minimum_generation
         self.generation = generation
         self.package_name = package_name
+        self._evolvers = {}
+
+        if preload:
+            for generation in range(1, self.generation + 1):
+                try:
+                    self._getEvolver(generation)
+                except ModuleNotFoundError as e:
+                    if e.name != self._evolverName(generation):
+                        raise
+
+    def _evolverName(self, generation):
+        return "%s.evolve%d" % (self.package_name, generation)
+
+    def _getEvolver(self, generation):
+        try:
+            return self._evolvers[generation]
+        except KeyError:
+            evolver = __import__(
+                self._evolverName(generation), {}, {}, ['*'])
+            self._evolvers[generation] = evolver
+            return evolver
 
     def evolve(self, context, generation):
         """Evolve a database to reflect software/schema changes."""
-        name = "%s.evolve%d" % (self.package_name, generation)
+        evolver = self._getEvolver(generation)
+        if hasattr(evolver, 'evolve'):
+            evolver.evolve(context)
+        elif hasattr(evolver, 'transform'):
+            _transformObjects(context.connection.root(),
+                              [evolver.transform], context.batch_size)
+        else:
+            _transformStates(context, evolver.state_transforms)
+
+    def getTransform(self, generation):
+        """Get the evolver's ``transform`` function, if any."""
+        return getattr(self._getEvolver(generation), 'transform', None)
 
-        evolver = __import__(name, {}, {}, ['*'])
+    def getStateTransforms(self, generation):
+        """Get the evolver's ``state_transforms``, if any."""
+        return getattr(self._getEvolver(generation), 'state_transforms',
+                       None)
 
-        evolver.evolve(context)
+    def validate(self, generation, target):
+        """Make sure the evolvers from *generation* to *target* exist."""
+        for generation in range(generation + 1, target + 1):
+            self._getEvolver(generation)
 
     def install(self, context):
         """Evolve a database to reflect software/schema changes."""
@@ -167,15 +286,141 @@ class SchemaManager:
 
     def getInfo(self, generation):
         """Get the information from the evolver function's doc string."""
-        evolver = __import__(
-            "%s.evolve%d" % (self.package_name, generation),
-            {}, {}, ['*'])
-        return evolver.evolve.__doc__
+        evolver = self._getEvolver(generation)
+        if hasattr(evolver, 'evolve'):
+            return evolver.evolve.__doc__
+        if hasattr(evolver, 'transform'):
+            return evolver.transform.__doc__
+        return evolver.__doc__
 
 
 class Context:
+    """The context passed to schema managers.
+
+    Its ``connection`` is the database connection to be used.
+    """
+
     connection = None
 
+    #: The cursor last passed to `checkpoint` while evolving to the
+    #: current generation, or `None` if the step starts from scratch.
+    cursor = None
+
+    #: How many objects an evolution step should change before it
+    #: commits or takes a savepoint, to keep the object cache small.
+    batch_size = 10000
+
+    _checkpoint = None
+
+    def checkpoint(self, cursor):
+        """Commit the work done so far together with *cursor*.
+
+        This can be called from `ISchemaManager.evolve
+        <zope.generations.interfaces.ISchemaManager.evolve>` to split
+        a big evolution step into several transactions.  The *cursor*
+        has to be a picklable value describing the progress made so
+        far; it is stored with the generations data.  If the step fails
+        later on, the next `evolve` starts the step again with `cursor`
+        set to the last cursor committed.
+        """
+        if self._checkpoint is None:
+            raise TypeError(
+                "checkpoint() can only be called by evolution steps")
+        self._checkpoint(cursor)
+        self.cursor = cursor
+
+    def progress(self, done, total=None):
+        """Report that *done* out of *total* items were processed.
+
+        Evolution and install steps can call this as often as they like
+        to tell how far they got.  Every few seconds, the progress is
+        logged and notified as an
+        `~zope.generations.interfaces.IEvolutionStepProgress` event,
+        along with the items done per second and, if the *total* is
+        known, an estimate of the time left.  Outside of a step, this
+        does nothing.  Long steps done by a `BackgroundEvolution` should
+        call it regularly: once the evolution is cancelled, it raises
+        `EvolutionCancelled`.
+        """
+        reportProgress(done, total)
+
+    def track(self, iterable, total=None):
+        """Iterate over *iterable*, reporting each item as done.
+
+        *total* defaults to the length of *iterable*, if it has one.
+        """
+        if total is None:
+            try:
+                total = len(iterable)
+            except TypeError:
+                pass
+        done = 0
+        for item in iterable:
+            yield item
+            done += 1
+            self.progress(done, total)
+
+
+_current = threading.local()
+
+
+def reportProgress(done, total=None):
+    """Report the progress of the step running in this thread.
+
+    This is `Context.progress` for code that has no context at hand,
+    like the functions in `zope.generations.utility`.  If the
+    `BackgroundEvolution` running the step was cancelled, this raises
+    `EvolutionCancelled`.
+    """
+    cancelled = getattr(_current, 'cancelled', None)
+    if cancelled is not None and cancelled.is_set():
+        raise EvolutionCancelled()
+    step = getattr(_current, 'step', None)
+    if step is not None:
+        step.progress(done, total)
+
+
+def _transformObjects(root, transforms, savepoint_every=Context.batch_size):
+    # Apply all *transforms* in order to every object found below *root*
+    # in a single traversal.  Regular optimistic savepoints move the
+    # changes out of the object cache, so it can shrink again.
+    from .utility import findObjectsMatching
+    count = 0
+
+    def transform(obj):
+        nonlocal count
+        for t in transforms:
+            t(obj)
+        count += 1
+        if count % savepoint_every == 0:
+            transaction.savepoint(optimistic=True)
+        return False
+
+    for _ in findObjectsMatching(root, transform, budget=savepoint_every):
+        pass
+
+
+def _transformStates(context, transforms):
+    # Apply the state *transforms* to the objects of their classes.
+    from ZODB.utils import get_pickle_metadata
+
+    from .utility import _currentRecords
+    from .utility import inBatches
+    conn = context.connection
+
+    def matches():
+        for oid, tid, data in _currentRecords(conn.db().storage):
+            transform = transforms.get('.'.join(get_pickle_metadata(data)))
+            if transform is not None:
+                yield oid, transform
+
+    for batch in inBatches(context, matches(), context.batch_size):
+        for oid, transform in batch:
+            obj = conn.get(oid)
+            obj._p_activate()
+            obj.__setstate__(transform(obj.__getstate__()))
+            obj._p_changed = True
+
 
 def findManagers():
     # Hook to let Chris use this for Zope 2
@@ -184,10 +429,84 @@ def findManagers():
 
 def PersistentDict():
     # Another hook to let Chris use this for Zope 2
-    import persistent.mapping
     return persistent.mapping.PersistentMapping()
 
 
+_missing = object()
+
+
+class GenerationsMapping(persistent.mapping.PersistentMapping):
+    """A persistent mapping resolving conflicts between different keys.
+
+    Schema managers evolved concurrently by `evolve` record their
+    generations in the same mapping.  Changes to different keys are
+    merged; changing the same key differently is still a conflict.
+    """
+
+    def _p_resolveConflict(self, old, committed, new):
+        from ZODB.POSException import ConflictError
+        old_data = old['data']
+        committed_data = committed['data']
+        new_data = new['data']
+        data = dict(committed_data)
+        for key in set(old_data) | set(new_data):
+            value = new_data.get(key, _missing)
+            if old_data.get(key, _missing) == value:
+                continue
+            if committed_data.get(key, _missing) not in (
+                    old_data.get(key, _missing), value):
+                raise ConflictError
+            if value is _missing:
+                del data[key]
+            else:
+                data[key] = value
+        state = dict(committed)
+        state['data'] = data
+        return state
+
+
+def _useGenerationsMapping(root, generations):
+    # Replace the generations data by a `GenerationsMapping`, keeping
+    # the keys under which it is stored pointing to the same object.
+    if isinstance(generations, GenerationsMapping):
+        return generations
+    mapping = GenerationsMapping(generations)
+    for key in (generations_key, old_generations_key):
+        if root.get(key) is generations:
+            root[key] = mapping
+    return mapping
+
+
+def prepareParallelEvolution(db):
+    """Let `evolve` evolve the schema managers of *db* in parallel.
+
+    The generations data of *db*, and the checkpoints recorded by
+    `Context.checkpoint`, are converted to `GenerationsMapping` objects,
+    which resolve the conflicts between schema managers recording
+    their generations at the same time.  As zope.generations 7.0 can't
+    load it, older versions can't evolve the database anymore after
+    this.
+    """
+    tm = transaction.TransactionManager()
+    conn = db.open(tm)
+    try:
+        with tm as tx:
+            tx.note('Preparing to evolve in parallel')
+            root = conn.root()
+            generations = root.get(generations_key)
+            if generations is None:
+                generations = root.get(old_generations_key, {})
+            mapping = _useGenerationsMapping(root, generations)
+            if root.get(generations_key) is not mapping:
+                root[generations_key] = mapping
+            # Where the steps evolved in parallel record checkpoints.
+            progress = root.get(progress_key, {})
+            if not isinstance(progress, GenerationsMapping):
+                root[progress_key] = GenerationsMapping(progress)
+    finally:
+        conn.close()
+
+
 #: Constant for the *how* argument to `evolve` indicating
 #: to evolve to the current generation.
 #:
@@ -205,7 +524,696 @@ EVOLVENOT = 'EVOLVENOT'
 EVOLVEMINIMUM = 'EVOLVEMINIMUM'
 
 
-def evolve(db, how=EVOLVE):
+def _fingerprint(managers):
+    # A compact digest of the name and generations of every manager.
+    data = repr([(key, manager.generation,
+                  getattr(manager, 'minimum_generation', None))
+                 for key, manager in managers])
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _upToDate(generations, managers, how):
+    """Check whether evolving in mode *how* would change nothing.
+
+    This is a read-only pass over the registered *managers* that avoids
+    a transaction per manager.
+
+    Returns `None` if there is work to do, otherwise `EVOLVE` if every
+    manager is at its current generation or `EVOLVEMINIMUM` if they
+    are only at their minimum generations.
+    """
+    level = EVOLVE
+    for key, manager in managers:
+        generation = generations.get(key)
+        if generation == manager.generation:
+            continue
+        if generation is None or generation > manager.generation:
+            return None
+        if generation < manager.minimum_generation:
+            return None
+        level = EVOLVEMINIMUM
+
+    if level != EVOLVE and how == EVOLVE:
+        return None
+    return level
+
+
+class EvolutionLease(persistent.Persistent):
+    """The right to evolve a database, given to one process at a time.
+
+    ``owner`` names the process holding the lease, or is `None`, and
+    ``expires`` is the time (as returned by `time.time`) when the lease
+    is given up if the owner doesn't renew it.
+    """
+
+    owner = None
+    expires = 0
+
+
+class _Lease:
+    """Take, renew and release the `EvolutionLease` of *db*.
+
+    A lease is renewed by a thread using a connection of its own every
+    third of *duration* seconds, until it is released.
+    """
+
+    def __init__(self, db, owner, duration):
+        if owner is None:
+            owner = '%s:%d:%d' % (socket.gethostname(), os.getpid(),
+                                  threading.get_ident())
+        self.db_name = db.database_name or 'main db'
+        self.owner = owner
+        self.duration = duration
+        self.poll_interval = min(duration / 4, 5)
+        self.tm = transaction.TransactionManager()
+        self.conn = db.open(self.tm)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _take(self):
+        try:
+            with self.tm:
+                root = self.conn.root()
+                lease = root.get(lease_key)
+                now = time.time()
+                if lease is None:
+                    lease = root[lease_key] = EvolutionLease()
+                elif lease.owner not in (None, self.owner) \
+                        and lease.expires > now:
+                    return lease.owner
+                lease.owner = self.owner
+                lease.expires = now + self.duration
+        except transaction.interfaces.TransientError:
+            # Somebody else took it just now.
+            return ''
+        return None
+
+    def acquire(self, done):
+        """Take the lease, or wait until ``done()`` returns true.
+
+        Returns whether the lease was taken.
+        """
+        holder = self._take()
+        if holder is not None:
+            logger.info('%s: waiting for %s to evolve',
+                        self.db_name, holder or 'another process')
+        while holder is not None:
+            time.sleep(self.poll_interval)
+            if done():
+                return False
+            holder = self._take()
+        logger.debug('%s: took the evolution lease', self.db_name)
+        self._thread = threading.Thread(
+            target=self._renew, daemon=True,
+            name='zope.generations evolution lease')
+        self._thread.start()
+        return True
+
+    def _renew(self):
+        while not self._stop.wait(self.duration / 3):
+            try:
+                with self.tm:
+                    lease = self.conn.root()[lease_key]
+                    if lease.owner != self.owner:
+                        logger.warning('%s: lost the evolution lease to %s',
+                                       self.db_name, lease.owner)
+                        return
+                    lease.expires = time.time() + self.duration
+            except transaction.interfaces.TransientError:
+                logger.warning('%s: unable to renew the evolution lease',
+                               self.db_name, exc_info=True)
+
+    def release(self):
+        try:
+            if self._thread is not None:
+                self._stop.set()
+                self._thread.join()
+                with self.tm:
+                    lease = self.conn.root()[lease_key]
+                    if lease.owner == self.owner:
+                        lease.owner = None
+                        lease.expires = 0
+        finally:
+            self.tm.abort()
+            self.conn.close()
+
+
+def _readCache(cache_file, db_name):
+    try:
+        with open(cache_file) as f:
+            return json.load(f)[db_name]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _writeCache(cache_file, db_name, entry):
+    try:
+        with open(cache_file) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    data[db_name] = entry
+    tmp = '%s.%d.tmp' % (cache_file, os.getpid())
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, cache_file)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        logger.warning('%s: could not write cache file %s',
+                       db_name, cache_file, exc_info=True)
+
+
+def _schedule(managers):
+    """Compute the order in which to evolve the sorted *managers*.
+
+    Returns a list of ``(key, manager, dependencies)`` tuples in the
+    order a serial run uses.  Managers providing `IDependentSchemaManager`
+    depend on the (registered) managers they name, all others on the
+    previous such manager in the order of their names.
+    """
+    names = {key for key, manager in managers}
+    dependencies = {}
+    previous = None
+    for key, manager in managers:
+        if IDependentSchemaManager.providedBy(manager):
+            dependencies[key] = {name for name in manager.depends_on
+                                 if name in names and name != key}
+        else:
+            dependencies[key] = set() if previous is None else {previous}
+            previous = key
+
+    by_name = dict(managers)
+    waiting = {key: set(deps) for key, deps in dependencies.items()}
+    ready = [key for key, deps in waiting.items() if not deps]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        key = heapq.heappop(ready)
+        order.append((key, by_name[key], dependencies[key]))
+        for other, deps in waiting.items():
+            if key in deps:
+                deps.remove(key)
+                if not deps:
+                    heapq.heappush(ready, other)
+    if len(order) != len(managers):
+        raise GenerationError(
+            "circular dependencies between schema managers",
+            sorted(key for key, deps in waiting.items() if deps))
+    return order
+
+
+def _transactionSize(storage, tid):
+    # Count the records and bytes of object data written by the
+    # transaction *tid*, or return (None, None) if the storage can't.
+    try:
+        records = storage.iterator(tid, tid)
+    except (AttributeError, NotImplementedError):
+        return None, None
+    objects = size = 0
+    try:
+        for txn in records:
+            for record in txn:
+                objects += 1
+                size += len(record.data or b'')
+    finally:
+        close = getattr(records, 'close', None)
+        if close is not None:
+            close()
+    return objects, size
+
+
+class _Profiler:
+    """Profile evolution steps, writing the results to *directory*.
+
+    Each step is run under `cProfile`; the statistics are dumped to
+    ``<name>.prof``.  If *trace_memory* is true, the allocation
+    differences with the biggest growth are written to
+    ``<name>.memory.txt``.
+    """
+
+    top = 50
+
+    def __init__(self, directory, trace_memory=False):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.trace_memory = trace_memory
+        self.started_tracing = False
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def close(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def start(self, name):
+        """Start profiling, returning a function to call when done."""
+        path = os.path.join(self.directory, name.replace(os.sep, '_'))
+        snapshot = None
+        if self.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active in this thread.
+            logger.warning('unable to profile %s', name, exc_info=True)
+            profile = None
+
+        def stop():
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(path + '.prof')
+            if snapshot is not None:
+                stats = tracemalloc.take_snapshot().compare_to(
+                    snapshot, 'lineno')
+                with open(path + '.memory.txt', 'w') as f:
+                    for stat in stats[:self.top]:
+                        print(stat, file=f)
+            logger.debug('wrote profile of %s to %s', name, path)
+        return stop
+
+
+class _Step:
+    """Measure an evolution step and notify the events about it."""
+
+    # Seconds between progress reports.
+    progress_interval = 5
+
+    def __init__(self, db, key, manager, generation, install=False,
+                 profiler=None, retries=0):
+        self.db = db
+        self.args = (db, key, manager, generation)
+        self.retries = retries
+        self.install = install
+        self.tids = []
+        started = events.InstallStarted if install else \
+            events.EvolutionStepStarted
+        zope.event.notify(started(*self.args))
+        self.stop_profile = None
+        if profiler is not None:
+            if install:
+                name = '%s-install' % key
+            else:
+                name = '%s-%d' % (key, generation)
+            self.stop_profile = profiler.start(name)
+        self.wall_time = self.reported = time.monotonic()
+        self.cpu_time = time.thread_time()
+        _current.step = self
+
+    def progress(self, done, total=None):
+        """Log and notify the progress, unless it was reported recently."""
+        now = time.monotonic()
+        if now - self.reported < self.progress_interval and done != total:
+            return
+        self.reported = now
+        elapsed = now - self.wall_time
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if total is not None and rate:
+            eta = max(total - done, 0) / rate
+        db, key, manager, generation = self.args
+        if eta is None:
+            logger.info('%s/%s: generation %d: %d done (%.1f/s)',
+                        db.database_name, key, generation, done, rate)
+        else:
+            logger.info('%s/%s: generation %d: %d of %d done (%.1f/s,'
+                        ' about %ds left)',
+                        db.database_name, key, generation, done, total,
+                        rate, eta)
+        zope.event.notify(events.EvolutionStepProgress(
+            *self.args, done=done, total=total, rate=rate, eta=eta))
+
+    def committed(self, obj):
+        """Remember the transaction that has just stored *obj*."""
+        # Objects updated by conflict resolution are turned into ghosts
+        # and keep their old serial.
+        if obj._p_changed is not None:
+            self.tids.append(obj._p_serial)
+
+    def finished(self, error=None):
+        _current.step = None
+        wall_time = time.monotonic() - self.wall_time
+        cpu_time = time.thread_time() - self.cpu_time
+        if self.stop_profile is not None:
+            self.stop_profile()
+        objects = size = None
+        for tid in self.tids:
+            txn_objects, txn_size = _transactionSize(self.db.storage, tid)
+            if txn_objects is None:
+                objects = size = None
+                break
+            objects = (objects or 0) + txn_objects
+            size = (size or 0) + txn_size
+        finished = events.InstallFinished if self.install else \
+            events.EvolutionStepFinished
+        zope.event.notify(finished(
+            *self.args, wall_time=wall_time, cpu_time=cpu_time,
+            objects=objects, size=size, retries=self.retries,
+            error=error))
+
+
+class _Options:
+    # How `evolve` was asked to do its work.
+
+    profiler = None
+    # Seconds to wait, at most, before the first retry of a step, and
+    # the limit for the following ones, which wait twice as long.
+    backoff = 0.1
+    max_backoff = 5
+    # How often steps running in parallel are tried again by default.
+    # They conflict whenever they change the same objects, like the root.
+    parallel_retries = 5
+
+    def __init__(self, squash=False, before_step=None, retries=None,
+                 batch_size=None):
+        self.squash = squash
+        self.before_step = before_step
+        self.retries = retries
+        self.batch_size = batch_size or Context.batch_size
+
+
+def _evolveWithConnection(db, db_name, key, manager, how, options,
+                          cancelled=None):
+    # Evolve a single schema manager using a connection of its own.
+    # *cancelled* is the event of the `BackgroundEvolution` running.
+    _current.cancelled = cancelled
+    conn = db.open()
+    try:
+        context = Context()
+        context.connection = conn
+        context.batch_size = options.batch_size
+        with transaction.manager:
+            generations = conn.root()[generations_key]
+        _evolveManager(context, generations, db_name, key, manager, how,
+                       options)
+    finally:
+        conn.close()
+        _current.cancelled = None
+
+
+def _evolveInParallel(db, db_name, managers, how, workers, options):
+    """Evolve the *managers* using up to *workers* threads.
+
+    A schema manager is started once all schema managers it depends on
+    are done.  After an error no further managers are started, and the
+    error is raised once the running ones finished.
+    """
+    if options.retries is None:
+        options.retries = options.parallel_retries
+    cancelled = getattr(_current, 'cancelled', None)
+    pending = _schedule(managers)
+    done = set()
+    running = {}
+    error = None
+    with concurrent.futures.ThreadPoolExecutor(
+            workers, thread_name_prefix='zope.generations') as executor:
+        while pending or running:
+            if error is None:
+                for entry in list(pending):
+                    key, manager, dependencies = entry
+                    if dependencies <= done:
+                        pending.remove(entry)
+                        future = executor.submit(
+                            _evolveWithConnection,
+                            db, db_name, key, manager, how, options,
+                            cancelled)
+                        running[future] = key
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                key = running.pop(future)
+                if future.exception() is not None:
+                    if error is None:
+                        error = future.exception()
+                else:
+                    done.add(key)
+    if error is not None:
+        raise error
+
+
+def _evolveManager(context, generations, db_name, key, manager, how,
+                   options):
+    """Evolve the database for a single schema manager.
+
+    *context* provides the connection *generations* was loaded with.
+    *options* is the `_Options` object of the run.
+    """
+    attempt = 0
+    while True:
+        step = None
+        try:
+            with transaction.manager as tx:
+                generation = generations.get(key)
+
+                if generation == manager.generation:
+                    logger.debug('%s/%s: up-to-date at generation %s',
+                                 db_name, key, generation)
+                    return
+
+                if generation is None:
+                    # This is a new database, so no old data
+
+                    step = _Step(context.connection.db(), key, manager,
+                                 manager.generation, install=True,
+                                 profiler=options.profiler, retries=attempt)
+                    if IInstallableSchemaManager.providedBy(manager):
+                        try:
+                            tx.note('%s: running install generation'
+                                    % key)
+                            logger.info("%s/%s: running install generation",
+                                        db_name, key)
+                            manager.install(context)
+                        except:  # noqa: E722 do not use bare 'except'
+                            logger.exception(
+                                "%s/%s: failed to run install",
+                                db_name, key)
+                            raise
+
+                    generations[key] = manager.generation
+        except BaseException as e:
+            if step is None:
+                raise
+            step.finished(e)
+            if not _retry(options, e, attempt, db_name, key,
+                          manager.generation):
+                raise
+            attempt += 1
+            continue
+
+        if step is not None:
+            step.committed(generations)
+            step.finished()
+            return
+        break
+
+    if generation > manager.generation:
+        logger.error('%s/%s: current generation too high (%d > %d)',
+                     db_name, key,
+                     generation, manager.generation)
+        raise GenerationTooHigh(generation, key, manager.generation)
+
+    if generation < manager.minimum_generation:
+        if how == EVOLVENOT:
+            logger.error('%s/%s: current generation too low '
+                         '(%d < %d) but mode is %s',
+                         db_name, key,
+                         generation, manager.minimum_generation,
+                         how)
+            raise GenerationTooLow(
+                generation, key, manager.minimum_generation)
+    else:
+        if how != EVOLVE:
+            return
+
+    if how == EVOLVEMINIMUM:
+        target = manager.minimum_generation
+    else:
+        target = manager.generation
+
+    logger.info(
+        '%s/%s: currently at generation %d, targetting generation %d',
+        db_name, key, generation, target)
+
+    if IValidatingSchemaManager.providedBy(manager):
+        try:
+            manager.validate(generation, target)
+        except:  # noqa: E722 do not use bare 'except'
+            logger.exception(
+                "%s/%s: unable to evolve from generation %d to %d",
+                db_name, key, generation, target)
+            if generation < manager.minimum_generation:
+                raise UnableToEvolve(generation + 1, key,
+                                     manager.generation)
+            return
+
+    squash = (options.squash
+              or ISquashableSchemaManager.providedBy(manager))
+    batch = IBatchSchemaManager.providedBy(manager)
+    lazy = ILazySchemaManager.providedBy(manager)
+    tx = savepoint = None
+    attempt = 0
+    while generation < target:
+        start = generation + 1
+        transforms = []
+        while batch and generation < target:
+            transform = manager.getTransform(generation + 1)
+            if transform is None:
+                break
+            transforms.append(transform)
+            generation += 1
+        if transforms and lazy:
+            if tx is not None:
+                transaction.commit()
+            logger.info('%s/%s: leaving generations %d to %d to lazy'
+                        ' evolution', db_name, key, start, generation)
+            if generation < manager.minimum_generation:
+                # The steps that follow can only be done once the
+                # objects were swept.
+                logger.error('%s/%s: generation %d needs the objects'
+                             ' evolved lazily to be swept first',
+                             db_name, key, generation + 1)
+                raise UnableToEvolve(generation + 1, key,
+                                     manager.generation)
+            return
+        if not transforms:
+            generation += 1
+        if options.before_step is not None:
+            try:
+                options.before_step(key, generation)
+            except BaseException:
+                if tx is not None:
+                    # Keep the steps squashed into this transaction so far.
+                    transaction.commit()
+                raise
+        if tx is None:
+            tx = transaction.begin()
+        elif (squash and not transforms
+              and IStateSchemaManager.providedBy(manager)
+              and manager.getStateTransforms(generation) is not None):
+            # State transforms only find the objects committed, so the
+            # steps squashed so far are committed first.
+            transaction.commit()
+            tx = transaction.begin()
+            savepoint = None
+        elif squash:
+            # Remember the state after the previous steps.
+            savepoint = transaction.savepoint()
+        step = _Step(context.connection.db(), key, manager, generation,
+                     profiler=options.profiler, retries=attempt)
+        try:
+            for g in range(start, generation + 1):
+                note = '%s: evolving to generation %d' % (key, g)
+                transaction.get().note(note)
+            if transforms:
+                logger.debug('%s/%s: evolving to generations %d to %d'
+                             ' in one pass',
+                             db_name, key, start, generation)
+                _transformObjects(context.connection.root(), transforms,
+                                  context.batch_size)
+            else:
+                _evolveStep(context, db_name, key, manager, generation,
+                            note, step)
+            generations[key] = generation
+            if not squash or generation == target:
+                transaction.commit()
+                step.committed(generations)
+                tx = None
+                attempt = 0
+        except BaseException as error:
+            # An unguarded handler is intended here
+            step.finished(error)
+            if _retry(options, error, attempt, db_name, key, generation):
+                # Start over after the last generation committed.
+                transaction.abort()
+                generation = generations[key]
+                tx = savepoint = None
+                attempt += 1
+                continue
+            if savepoint is not None and savepoint.valid:
+                # Keep the steps squashed into this transaction so far.
+                savepoint.rollback()
+                transaction.commit()
+            else:
+                transaction.abort()
+            if isinstance(error, EvolutionCancelled):
+                raise
+            logger.exception(
+                "%s/%s: failed to evolve to generation %d",
+                db_name, key, generation)
+
+            if start <= manager.minimum_generation:
+                raise UnableToEvolve(start, key,
+                                     manager.generation)
+            return
+        else:
+            step.finished()
+
+
+# Waits before retrying a step; replaced by the tests.
+_sleep = time.sleep
+
+
+def _retry(options, error, attempt, db_name, key, generation):
+    # Tell whether to try a step again after it failed with *error*,
+    # waiting for a random time growing with each *attempt* first.
+    if not isinstance(error, transaction.interfaces.TransientError):
+        return False
+    if attempt >= (options.retries or 0):
+        return False
+    logger.warning(
+        '%s/%s: transient error evolving to generation %d, retrying'
+        ' (%d of %d): %s',
+        db_name, key, generation, attempt + 1, options.retries, error)
+    _sleep(random.uniform(
+        0, min(options.max_backoff, options.backoff * 2 ** attempt)))
+    return True
+
+
+def _evolveStep(context, db_name, key, manager, generation, note, step):
+    # Call the manager to evolve to *generation*, letting it resume from
+    # and record checkpoints.
+    logger.debug('%s/%s: evolving to generation %d',
+                 db_name, key, generation)
+    root = context.connection.root()
+    resume = root.get(progress_key, {}).get(key)
+    if resume is not None and resume[0] == generation:
+        context.cursor = resume[1]
+        logger.info('%s/%s: resuming generation %d from %r',
+                    db_name, key, generation, context.cursor)
+
+    def checkpoint(cursor):
+        progress = root.get(progress_key)
+        if progress is None:
+            progress = root[progress_key] = PersistentDict()
+        progress[key] = (generation, cursor)
+        transaction.commit()
+        step.committed(progress)
+        transaction.begin().note(note)
+        logger.debug('%s/%s: checkpoint %r of generation %d',
+                     db_name, key, cursor, generation)
+
+    context._checkpoint = checkpoint
+    try:
+        manager.evolve(context, generation)
+    finally:
+        context.cursor = context._checkpoint = None
+    progress = root.get(progress_key)
+    if progress is not None and key in progress:
+        del progress[key]
+
+
+def evolve(db, how=EVOLVE, cache_file=None, workers=1, squash=False,
+           profile_dir=None, trace_memory=None, before_step=None,
+           lease_duration=None, lease_owner=None, retries=None,
+           batch_size=None):
     """Evolve a database
 
     We evolve a database using registered application schema managers.
@@ -433,14 +1441,121 @@ def evolve(db, how=EVOLVE):
       >>> db.close()
       >>> tearDown()
 
+    If *cache_file* is given, or the environment variable named by
+    `cache_file_variable` is set, the path is used to remember the
+    storage's last transaction and the schema managers seen when the
+    database was last found to be up-to-date.  As long as neither of
+    them changes, `evolve` returns without even opening a connection.
+
+    If *workers* is greater than one, up to that many schema managers are
+    evolved concurrently, each using a connection of its own.  Schema
+    managers have to provide
+    `~zope.generations.interfaces.IDependentSchemaManager` to take part
+    in this; the others are still evolved one after another in the
+    order of their names.  To avoid conflicts, the generations data has
+    to be converted by `prepareParallelEvolution` first; otherwise the
+    schema managers are evolved one at a time.  Steps changing the same
+    objects at the same time, like the root, still conflict, so unless
+    *retries* is given, they are tried again up to five times.
+
+    Normally, every evolution step is committed in a transaction of its
+    own.  If *squash* is true, all the steps of a schema manager are
+    done in a single transaction instead, as they are for schema
+    managers providing
+    `~zope.generations.interfaces.ISquashableSchemaManager`.  If a step
+    fails, the steps before it are still committed.  So are the steps
+    before one having state transforms (see
+    `~zope.generations.interfaces.IStateSchemaManager`), which only
+    find the objects committed.
+
+    Unless the cache file shows there is nothing to do, the events
+    defined in `zope.generations.events` are notified when the
+    evolution starts and finishes, as well as before and after each
+    install and evolution step.  The finished events report the time
+    spent and, for the steps, the size of the transactions committed.
+
+    If *profile_dir* is given, or the environment variable named by
+    `profile_dir_variable` is set, every install and evolution step is
+    run under `cProfile`, and the statistics are saved in that
+    directory as ``<key>-<generation>.prof`` (``<key>-install.prof``
+    for installs).  If *trace_memory* is true, or it is `None` and the
+    environment variable named by `trace_memory_variable` is set to a
+    non-empty value, `tracemalloc` is used to save the allocations
+    growing the most during each step in ``<key>-<generation>.memory.txt``.
+    As `tracemalloc` traces all threads, these include the allocations
+    of other steps running at the same time.
+
+    If *before_step* is given, it is called with the name of the schema
+    manager and the generation to be reached before every evolution
+    step.  It may wait, to limit the load caused by evolving, or raise
+    an exception to stop; this exception is raised by `evolve` after
+    committing the steps done so far.
+
+    If *lease_duration* is given, or the environment variable named by
+    `lease_duration_variable` is set, several processes may call
+    `evolve` for the same database at once: only the process that
+    takes the `EvolutionLease` stored in the database evolves it.  The
+    others poll the database until the work is done or the lease is
+    free again.  The owner renews the lease while evolving; if it dies,
+    the lease expires after *lease_duration* seconds and another
+    process takes over.  *lease_owner* names the process; the default
+    is made of the host name, process and thread id.  The clocks of the
+    processes have to agree to well within *lease_duration*.
+
+    An install or evolution step failing with a transient error, like a
+    `~ZODB.POSException.ConflictError`, is tried again up to *retries*
+    times, after waiting for a random time that grows with each
+    attempt.  The steps not committed yet are started over.  Only when
+    the retries are used up, the step is treated as failed.  By
+    default, steps are only tried again when evolving in parallel.
+
+    *batch_size* is passed to the schema managers as the context's
+    ``batch_size``: how many objects a step should change before it
+    commits or takes a savepoint.  The transforms of
+    `~zope.generations.interfaces.IBatchSchemaManager` steps take a
+    savepoint after that many objects.
     """
     db_name = db.database_name or 'main db'
     logger.info('%s: evolving in mode %s',
                 db_name, how)
+    if cache_file is None:
+        cache_file = os.environ.get(cache_file_variable) or None
+    managers = sorted(findManagers())
+    if cache_file is not None:
+        # Read this before opening the connection: If somebody commits
+        # in the meantime, we'll merely miss the cache next time.
+        tid = db.lastTransaction().hex()
+        entry = _readCache(cache_file, db_name)
+        if (entry is not None
+                and entry.get('tid') == tid
+                and entry.get('fingerprint') == _fingerprint(managers)
+                and (entry.get('level') == EVOLVE or how != EVOLVE)):
+            logger.debug('%s: up-to-date according to %s',
+                         db_name, cache_file)
+            return
+
+    if profile_dir is None:
+        profile_dir = os.environ.get(profile_dir_variable) or None
+    if trace_memory is None:
+        trace_memory = bool(os.environ.get(trace_memory_variable))
+    if lease_duration is None:
+        lease_duration = os.environ.get(lease_duration_variable) or None
+        if lease_duration is not None:
+            lease_duration = float(lease_duration)
+    options = _Options(squash, before_step, retries, batch_size)
+    if profile_dir is not None:
+        options.profiler = _Profiler(profile_dir, trace_memory)
+
+    zope.event.notify(events.EvolutionStarted(db, how))
+    wall_time = time.monotonic()
+    cpu_time = time.thread_time()
+    error = None
+    lease = None
     conn = db.open()
     try:
         context = Context()
         context.connection = conn
+        context.batch_size = options.batch_size
         with transaction.manager:
             root = conn.root()
             generations = root.get(generations_key)
@@ -452,87 +1567,259 @@ def evolve(db, how=EVOLVE):
                     root[generations_key] = generations
                 else:
                     generations = root[generations_key] = PersistentDict()
+            up_to_date = _upToDate(generations, managers, how)
+            if up_to_date is None:
+                if workers > 1 and not isinstance(generations,
+                                                  GenerationsMapping):
+                    logger.warning(
+                        '%s: evolving one schema manager at a time, call'
+                        ' prepareParallelEvolution() to evolve them in'
+                        ' parallel', db_name)
+                    workers = 1
+        if up_to_date is not None:
+            logger.debug('%s: all schema managers up-to-date', db_name)
+            if cache_file is not None:
+                _writeCache(cache_file, db_name, {
+                    'tid': tid,
+                    'fingerprint': _fingerprint(managers),
+                    'level': up_to_date,
+                })
+            return
 
-        for key, manager in sorted(findManagers()):
-            with transaction.manager as tx:
-                generation = generations.get(key)
+        if lease_duration is not None:
+            lease = _Lease(db, lease_owner, lease_duration)
 
-                if generation == manager.generation:
-                    logger.debug('%s/%s: up-to-date at generation %s',
-                                 db_name, key, generation)
-                    continue
+            def done():
+                with transaction.manager:
+                    root = conn.root()
+                    return _upToDate(root[generations_key], managers,
+                                     how) is not None
 
-                if generation is None:
-                    # This is a new database, so no old data
+            if not lease.acquire(done):
+                logger.debug('%s: evolved by another process', db_name)
+                return
 
-                    if IInstallableSchemaManager.providedBy(manager):
-                        try:
-                            tx.note('%s: running install generation'
-                                    % key)
-                            logger.info("%s/%s: running install generation",
-                                        db_name, key)
-                            manager.install(context)
-                        except:  # noqa: E722 do not use bare 'except'
-                            logger.exception("%s/%s: failed to run install",
-                                             db_name, key)
-                            raise
+        if workers > 1:
+            _evolveInParallel(db, db_name, managers, how, workers, options)
+            return
 
-                    generations[key] = manager.generation
-                    continue
+        for key, manager, _ in _schedule(managers):
+            _evolveManager(context, generations, db_name, key, manager, how,
+                           options)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        if lease is not None:
+            lease.release()
+        conn.close()
+        if options.profiler is not None:
+            options.profiler.close()
+        zope.event.notify(events.EvolutionFinished(
+            db, how, time.monotonic() - wall_time,
+            time.thread_time() - cpu_time, error))
 
-            if generation > manager.generation:
-                logger.error('%s/%s: current generation too high (%d > %d)',
-                             db_name, key,
-                             generation, manager.generation)
-                raise GenerationTooHigh(generation, key, manager.generation)
 
-            if generation < manager.minimum_generation:
-                if how == EVOLVENOT:
-                    logger.error('%s/%s: current generation too low '
-                                 '(%d < %d) but mode is %s',
-                                 db_name, key,
-                                 generation, manager.minimum_generation,
-                                 how)
-                    raise GenerationTooLow(
-                        generation, key, manager.minimum_generation)
-            else:
-                if how != EVOLVE:
-                    continue
+#: The evolution `plan` for one schema manager.  *current* is the
+#: generation recorded in the database (`None` if the manager still has
+#: to be installed), *target* the generation it would be evolved to and
+#: *steps* the `PlannedStep` objects leading there.
+ManagerPlan = collections.namedtuple(
+    'ManagerPlan', ['key', 'current', 'target', 'steps'])
 
-            if how == EVOLVEMINIMUM:
-                target = manager.minimum_generation
-            else:
-                target = manager.generation
+#: A step of a `ManagerPlan`.  *info* is the schema manager's
+#: ``getInfo`` text and *required* tells if the step is needed to reach
+#: the manager's minimum generation.
+PlannedStep = collections.namedtuple(
+    'PlannedStep', ['generation', 'info', 'required'])
 
-            logger.info(
-                '%s/%s: currently at generation %d, targetting generation %d',
-                db_name, key, generation, target)
 
-            while generation < target:
-                generation += 1
-                tx = transaction.begin()
-                try:
-                    tx.note('%s: evolving to generation %d'
-                            % (key, generation))
-                    logger.debug('%s/%s: evolving to generation %d',
-                                 db_name, key, generation)
-                    manager.evolve(context, generation)
-                    generations[key] = generation
-                    tx.commit()
-                except:  # noqa: E722 do not use bare 'except'
-                    # An unguarded handler is intended here
-                    tx.abort()
-                    logger.exception(
-                        "%s/%s: failed to evolve to generation %d",
-                        db_name, key, generation)
-
-                    if generation <= manager.minimum_generation:
-                        raise UnableToEvolve(generation, key,
-                                             manager.generation)
-                    break
+def plan(db, how=EVOLVE):
+    """Compute what `evolve` would do with *db* without changing it.
+
+    Returns a list of `ManagerPlan` objects, one per registered schema
+    manager, in the order in which `evolve` handles them.  Like
+    `evolve`, this raises `GenerationTooHigh` or, for `EVOLVENOT`,
+    `GenerationTooLow` if a manager can't work with the database.
+
+    The generations are read from a snapshot of the database using a
+    connection and transaction manager of its own; nothing is written.
+    """
+    managers = sorted(findManagers())
+    tm = transaction.TransactionManager()
+    conn = db.open(tm)
+    try:
+        with tm:
+            root = conn.root()
+            generations = root.get(generations_key)
+            if generations is None:
+                generations = root.get(old_generations_key, {})
+            generations = dict(generations)
     finally:
         conn.close()
 
+    result = []
+    for key, manager, _ in _schedule(managers):
+        generation = generations.get(key)
+        if generation is None:
+            result.append(ManagerPlan(key, None, manager.generation, ()))
+            continue
+        if generation > manager.generation:
+            raise GenerationTooHigh(generation, key, manager.generation)
+        target = generation
+        if generation < manager.minimum_generation:
+            if how == EVOLVENOT:
+                raise GenerationTooLow(
+                    generation, key, manager.minimum_generation)
+            target = manager.minimum_generation
+        if how == EVOLVE:
+            target = manager.generation
+        steps = tuple(
+            PlannedStep(g, manager.getInfo(g),
+                        g <= manager.minimum_generation)
+            for g in range(generation + 1, target + 1))
+        result.append(ManagerPlan(key, generation, target, steps))
+    return result
+
+
+class EvolutionCancelled(Exception):
+    """A `BackgroundEvolution` was cancelled."""
+
+
+_background = {}
+
+
+class BackgroundEvolution:
+    """Evolve a database in a thread of its own.
+
+    Once started, `evolve` is called with the database, *how* and the
+    keyword arguments given in a daemon thread, waiting *delay* seconds
+    before each evolution step but the first.  The attributes tell how
+    far it got:
+
+    ``state``
+        One of ``'pending'``, ``'running'``, ``'finished'``,
+        ``'failed'`` and ``'cancelled'``.
+
+    ``step``
+        The name of the schema manager and the generation of the last
+        evolution step started, or `None`.
+
+    ``steps``
+        The number of evolution steps started.
+
+    ``error``
+        The exception that made the evolution fail.
+
+    When evolving to the current generation, the objects of schema
+    managers that left generations to lazy evolution (see
+    `~zope.generations.interfaces.ILazySchemaManager`) are swept
+    afterwards using `zope.generations.lazy.sweep`, and the steps that
+    follow are done then.
+
+    Once cancelled, no further step is started, and a step reporting
+    its progress (see `Context.progress`) is stopped by
+    `EvolutionCancelled`, keeping the work it committed with
+    `Context.checkpoint`.  The evolution is cancelled when the process
+    exits, waiting up to `shutdown_timeout` seconds for the step being
+    done.
+    """
+
+    state = 'pending'
+    step = None
+    steps = 0
+    error = None
+    #: Seconds to wait for the step being done when the process exits.
+    shutdown_timeout = 10
+
+    def __init__(self, db, how=EVOLVE, delay=0, **kw):
+        self.db = db
+        self.how = how
+        self.delay = delay
+        self.kw = kw
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, daemon=True,
+            name='zope.generations background evolution')
+
+    def start(self):
+        """Start evolving."""
+        _background[self.db.database_name] = self
+        atexit.register(self.cancel, self.shutdown_timeout)
+        self.state = 'running'
+        self._thread.start()
+
+    def cancel(self, timeout=None):
+        """Stop before the next evolution step.
+
+        The step being done is stopped the next time it reports its
+        progress.  Waits up to *timeout* seconds for it.
+        """
+        self._cancelled.set()
+        self.join(timeout)
+
+    def join(self, timeout=None):
+        """Wait up to *timeout* seconds for the evolution to end."""
+        if self._thread.ident is not None:
+            self._thread.join(timeout)
+
+    def _beforeStep(self, key, generation):
+        if self.steps and self.delay:
+            self._cancelled.wait(self.delay)
+        if self._cancelled.is_set():
+            raise EvolutionCancelled()
+        self.step = (key, generation)
+        self.steps += 1
+
+    def _generations(self):
+        with self.db.transaction() as conn:
+            return dict(conn.root().get(generations_key, {}))
+
+    def _sweep(self):
+        # Sweep the objects evolved lazily, returning whether this
+        # advanced the generation of a schema manager.
+        from .lazy import sweep
+        before = self._generations()
+        for key, manager in sorted(findManagers()):
+            if ILazySchemaManager.providedBy(manager):
+                if self._cancelled.is_set():
+                    raise EvolutionCancelled()
+                sweep(self.db, key, delay=self.delay)
+        return self._generations() != before
+
+    def _run(self):
+        db_name = self.db.database_name or 'main db'
+        _current.cancelled = self._cancelled
+        try:
+            evolve(self.db, self.how, before_step=self._beforeStep,
+                   **self.kw)
+            while self.how == EVOLVE and self._sweep():
+                evolve(self.db, self.how, before_step=self._beforeStep,
+                       **self.kw)
+        except EvolutionCancelled:
+            logger.info('%s: background evolution cancelled', db_name)
+            self.state = 'cancelled'
+        except BaseException as e:
+            logger.exception('%s: background evolution failed', db_name)
+            self.error = e
+            self.state = 'failed'
+        else:
+            self.state = 'finished'
+        finally:
+            atexit.unregister(self.cancel)
+
+
+def getBackgroundEvolution(db):
+    """Return the `BackgroundEvolution` last started for *db*, if any."""
+    return _background.get(db.database_name)
+
+
+def evolveInBackground(db, how=EVOLVE, delay=0, **kw):
+    """Start and return a `BackgroundEvolution` of *db*."""
+    evolution = BackgroundEvolution(db, how, delay, **kw)
+    evolution.start()
+    return evolution
+
 
 def evolveSubscriber(event):
     """
@@ -563,3 +1850,21 @@ def evolveMinimumSubscriber(event):
     This is registered in this package's ``subscriber.zcml`` file.
     """
     evolve(event.database, EVOLVEMINIMUM)
+
+
+def evolveInBackgroundSubscriber(event):
+    """
+    A subscriber for :class:`zope.processlifetime.IDatabaseOpenedWithRoot` that
+    evolves all components to their required minimum version and then
+    continues evolving them to their current generation in the background.
+
+    The number of seconds to wait between the evolution steps done in
+    the background is read from the environment variable named by
+    `step_delay_variable`.  Use `getBackgroundEvolution` to see how far
+    the evolution got.
+
+    If you want to use this subscriber, you must register it.
+    """
+    evolve(event.database, EVOLVEMINIMUM)
+    delay = float(os.environ.get(step_delay_variable) or 0)
+    evolveInBackground(event.database, EVOLVE, delay)
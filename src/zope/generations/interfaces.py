@@ -58,6 +58,13 @@ class ISchemaManager(zope.interface.Interface):
         will be committed by the caller if there is no error. The
         method may create savepoints.
 
+        Steps too big for a single transaction can call
+        ``context.checkpoint(cursor)`` to commit the work done so far
+        together with a cursor describing it. If the step doesn't
+        finish, it is called again later with ``context.cursor`` set
+        to the last cursor committed, so that it can continue from
+        there.
+
         .. versionchanged:: 5.0
 
             Previously this documentation contained a provision for committing
@@ -65,6 +72,10 @@ class ISchemaManager(zope.interface.Interface):
             was unclear and incompatible with explicit transaction managers.
 
             Now, this method must *never* commit the transaction.
+
+        .. versionchanged:: 7.1
+
+            Added ``context.checkpoint`` and ``context.cursor``.
         """
 
     def getInfo(generation):
@@ -97,3 +108,227 @@ class IInstallableSchemaManager(ISchemaManager):
 
             Now, this method must *never* commit the transaction.
         """
+
+
+class IValidatingSchemaManager(ISchemaManager):
+    """A schema manager that can tell beforehand whether it can evolve.
+
+    .. versionadded:: 7.1
+    """
+
+    def validate(generation, target):
+        """Make sure the database can evolve from *generation* to *target*.
+
+        This is called before the first evolution step is started. An
+        exception should be raised if any of the steps needed is
+        missing, so that no step is committed at all.
+        """
+
+
+class IBatchSchemaManager(ISchemaManager):
+    """Schema manager able to evolve a database object by object.
+
+    Many evolution steps just make a small change to every object of a
+    kind.  Instead of walking the database in `ISchemaManager.evolve`,
+    such a step can provide a transform for single objects.
+    `~zope.generations.generations.evolve` then applies the transforms
+    of consecutive generations in one traversal of the database and
+    one transaction.
+
+    .. versionadded:: 7.1
+    """
+
+    def getTransform(generation):
+        """Return the transform evolving objects to *generation*.
+
+        The transform is called with every object found below the root
+        of the database, in the way
+        `~zope.generations.utility.findObjectsMatching` finds them.
+        It has to leave objects it isn't interested in alone and must
+        not depend on the order in which objects are visited.
+
+        Return `None` if *generation* needs a call to `evolve`.
+        """
+
+
+class IStateSchemaManager(ISchemaManager):
+    """Schema manager able to evolve the states of objects.
+
+    Evolution steps that only change the state of objects of some
+    classes can provide functions doing so.  They don't need the
+    objects, so `zope.generations.migrate.migrate` can apply them to the
+    object records while copying a database.
+
+    .. versionadded:: 7.1
+    """
+
+    def getStateTransforms(generation):
+        """Return the state transforms evolving to *generation*.
+
+        The result maps the dotted names of classes to functions called
+        with the state of each object of the class, as returned by
+        ``__getstate__``, and returning its new state.  They may change
+        the state they are passed and return it.  They must not depend
+        on other objects: the persistent objects referenced by the
+        state may be stand-ins that can only be stored.
+
+        Return `None` if *generation* needs a call to `evolve`.
+        """
+
+
+class ILazySchemaManager(IBatchSchemaManager):
+    """Schema manager whose transforms are applied when objects are loaded.
+
+    `~zope.generations.generations.evolve` stops before the evolution
+    steps having a transform.  They are applied to the objects deriving
+    from `zope.generations.lazy.LazilyEvolved` instead, when these are
+    loaded, and `zope.generations.lazy.sweep` advances the generation
+    once all of them were written.
+
+    .. versionadded:: 7.1
+    """
+
+
+class ISquashableSchemaManager(ISchemaManager):
+    """Marker for schema managers whose steps are cheap.
+
+    `~zope.generations.generations.evolve` applies all the evolution
+    steps needed for such a schema manager in a single transaction,
+    using savepoints between the steps.
+
+    .. versionadded:: 7.1
+    """
+
+
+class IDependentSchemaManager(ISchemaManager):
+    """A schema manager declaring which schema managers it depends on.
+
+    Schema managers that don't provide this interface are evolved in the
+    order of their names, after all other such managers whose names sort
+    before theirs.  Declaring the dependencies explicitly allows
+    `~zope.generations.generations.evolve` to evolve unrelated schema
+    managers concurrently.
+
+    .. versionadded:: 7.1
+    """
+
+    depends_on = zope.interface.Attribute(
+        "Names of the schema managers that must be evolved before this"
+        " one.  An empty sequence declares the manager independent.")
+
+
+class IEvolutionStarted(zope.interface.Interface):
+    """`~zope.generations.generations.evolve` starts evolving a database.
+
+    .. versionadded:: 7.1
+    """
+
+    database = zope.interface.Attribute("The database being evolved")
+
+    how = zope.interface.Attribute(
+        "The mode of evolution, one of ``EVOLVE``, ``EVOLVENOT`` and"
+        " ``EVOLVEMINIMUM``")
+
+
+class IEvolutionFinished(IEvolutionStarted):
+    """`~zope.generations.generations.evolve` is done with a database.
+
+    .. versionadded:: 7.1
+    """
+
+    wall_time = zope.interface.Attribute("Seconds elapsed")
+
+    cpu_time = zope.interface.Attribute(
+        "Seconds of CPU time used by the thread calling ``evolve``")
+
+    error = zope.interface.Attribute(
+        "The exception raised by ``evolve``, or `None`")
+
+
+class IEvolutionStepStarted(zope.interface.Interface):
+    """A schema manager starts evolving a database to a generation.
+
+    These events are notified in the thread doing the work, which isn't
+    the one calling ``evolve`` if schema managers are evolved
+    concurrently.
+
+    .. versionadded:: 7.1
+    """
+
+    database = zope.interface.Attribute("The database being evolved")
+
+    key = zope.interface.Attribute("The name of the schema manager")
+
+    manager = zope.interface.Attribute("The schema manager")
+
+    generation = zope.interface.Attribute(
+        "The generation reached by the step.  A single pass applying"
+        " the transforms of several generations counts as one step to"
+        " the last of them.")
+
+
+class IEvolutionStepProgress(IEvolutionStepStarted):
+    """An evolution or install step reports how far it got.
+
+    Steps report their progress using
+    `zope.generations.generations.Context.progress`.  The reports are
+    throttled, so that these events are notified every few seconds at
+    most.
+
+    .. versionadded:: 7.1
+    """
+
+    done = zope.interface.Attribute("The number of items done so far")
+
+    total = zope.interface.Attribute(
+        "The number of items expected, or `None` if unknown")
+
+    rate = zope.interface.Attribute("The items done per second")
+
+    eta = zope.interface.Attribute(
+        "The estimated seconds left, or `None` without a total")
+
+
+class IEvolutionStepFinished(IEvolutionStepStarted):
+    """A schema manager is done evolving a database to a generation.
+
+    This is notified when the step failed, too.
+
+    .. versionadded:: 7.1
+    """
+
+    wall_time = zope.interface.Attribute("Seconds elapsed")
+
+    cpu_time = zope.interface.Attribute("Seconds of CPU time used")
+
+    objects = zope.interface.Attribute(
+        "The number of objects written by the transactions committed"
+        " during the step, or `None` if nothing was committed or the"
+        " storage can't tell")
+
+    size = zope.interface.Attribute(
+        "The number of bytes of object data in these transactions, or"
+        " `None`")
+
+    retries = zope.interface.Attribute(
+        "How many times the step was started again after a transient"
+        " error")
+
+    error = zope.interface.Attribute(
+        "The exception that made the step fail, or `None`")
+
+
+class IInstallStarted(IEvolutionStepStarted):
+    """A schema manager starts installing itself in a database.
+
+    The generation is the one the schema manager is installed with.
+
+    .. versionadded:: 7.1
+    """
+
+
+class IInstallFinished(IEvolutionStepFinished):
+    """A schema manager is done installing itself in a database.
+
+    .. versionadded:: 7.1
+    """
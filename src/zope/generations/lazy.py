@@ -0,0 +1,226 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Evolve objects lazily, when they are loaded.
+
+Evolution steps of a schema manager providing
+`~zope.generations.interfaces.ILazySchemaManager` that have a transform
+(see `~zope.generations.interfaces.IBatchSchemaManager`) aren't run by
+`~zope.generations.generations.evolve`.  Instead, the transforms are
+applied to objects of classes deriving from `LazilyEvolved` when they
+are loaded, and `sweep` writes the evolved objects back over time.
+Only when all of them were swept, the generation recorded in the
+database is advanced; then `~zope.generations.generations.evolve` can
+continue with the steps that follow.
+"""
+import logging
+import time
+
+import transaction
+import zope.component
+
+from .generations import generations_key
+from .generations import reportProgress
+from .interfaces import ILazySchemaManager
+from .interfaces import ISchemaManager
+
+
+logger = logging.getLogger('zope.generations')
+
+_stamp = '_generations_stamp'
+
+
+def _storedGeneration(jar, key):
+    # The generation recorded in the database of *jar* for *key*.
+    generations = jar.root().get(generations_key)
+    if generations is None:
+        return None
+    return generations.get(key)
+
+
+def _lazyTarget(manager, generation):
+    # The last generation reachable from *generation* by transforms.
+    while generation < manager.generation:
+        if manager.getTransform(generation + 1) is None:
+            break
+        generation += 1
+    return generation
+
+
+def _queryManager(key):
+    manager = zope.component.queryUtility(ISchemaManager, key)
+    if manager is not None and ILazySchemaManager.providedBy(manager):
+        return manager
+    return None
+
+
+class LazilyEvolved:
+    """Mix-in class for persistent objects evolved when loaded.
+
+    Subclasses have to set ``_generations_key`` to the name of the
+    schema manager evolving them, and their state has to be a
+    dictionary.  The state is stamped with the generation the object
+    was evolved to.  An object without a stamp is taken to be at the
+    generation recorded in the database.
+
+    When loaded, the transforms for the generations from the stamp up to
+    the last generation having a transform are applied.  The object
+    isn't marked as changed by this; the evolved state is written when
+    the object is changed next, or by `sweep`.
+    """
+
+    _generations_key = None
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        manager = _queryManager(self._generations_key)
+        if manager is None or self._p_jar is None:
+            return
+        stored = _storedGeneration(self._p_jar, self._generations_key)
+        if stored is None:
+            return
+        # All objects have reached the recorded generation, even those
+        # stamped lower before full evolution steps were done.
+        generation = max(self.__dict__.get(_stamp, stored), stored)
+        start = generation
+        while generation < manager.generation:
+            transform = manager.getTransform(generation + 1)
+            if transform is None:
+                break
+            transform(self)
+            generation += 1
+        self.__dict__[_stamp] = generation
+        if generation != start:
+            self._v_generations_evolved = True
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        if _stamp not in state:
+            # A new object, written by the current software.
+            manager = _queryManager(self._generations_key)
+            if manager is not None:
+                state = dict(state)
+                state[_stamp] = manager.generation
+        return state
+
+
+def sweep(db, key, batch_size=1000, delay=0):
+    """Write all objects evolved lazily for the schema manager *key*.
+
+    All objects of classes deriving from `LazilyEvolved` for *key* are
+    loaded, evolving them, and those that were evolved are written in
+    transactions of *batch_size* objects, waiting *delay* seconds after
+    each one.  The objects are found by reading the current records of
+    the storage, as `~zope.generations.utility.findOidsByClass` does.
+
+    If all objects could be written, the generation recorded in the
+    database is advanced to the last generation having a transform.
+    Returns `True` then, or `False` if objects were left because of
+    conflicts; sweeping again takes care of them.
+
+    A `~zope.generations.generations.BackgroundEvolution` evolving to
+    the current generation sweeps after evolving, and stops sweeping
+    when cancelled.  Otherwise, the application has to call this.
+    """
+    from ZODB.POSException import ConflictError
+    from ZODB.utils import get_pickle_metadata
+
+    from .utility import _currentRecords
+
+    manager = zope.component.getUtility(ISchemaManager, key)
+    tm = transaction.TransactionManager()
+    conn = db.open(tm)
+    db_name = db.database_name or 'main db'
+    try:
+        with tm:
+            start = _storedGeneration(conn, key)
+            if start is None:
+                return True
+            target = _lazyTarget(manager, start)
+            if target == start or not ILazySchemaManager.providedBy(manager):
+                return True
+        logger.info('%s/%s: sweeping objects evolved to generation %d',
+                    db_name, key, target)
+
+        classes = {}
+
+        def isLazy(module, name):
+            try:
+                return classes[module, name]
+            except KeyError:
+                pass
+            try:
+                cls = db.classFactory(conn, module, name)
+            except Exception:
+                lazy = False
+            else:
+                lazy = (isinstance(cls, type)
+                        and issubclass(cls, LazilyEvolved)
+                        and cls._generations_key == key)
+            classes[module, name] = lazy
+            return lazy
+
+        complete = True
+        written = 0
+
+        def commit(count):
+            nonlocal complete, written
+            try:
+                tm.commit()
+            except ConflictError:
+                tm.abort()
+                logger.info('%s/%s: conflict while sweeping', db_name, key,
+                            exc_info=True)
+                complete = False
+            else:
+                written += count
+            conn.cacheGC()
+            # Stop if the background evolution doing this was cancelled.
+            reportProgress(written)
+            if delay:
+                time.sleep(delay)
+
+        tm.begin()
+        # Make sure the objects are loaded, so that they are evolved.
+        conn.cacheMinimize()
+        pending = 0
+        for oid, tid, data in _currentRecords(db.storage):
+            if not isLazy(*get_pickle_metadata(data)):
+                continue
+            obj = conn.get(oid)
+            obj._p_activate()
+            if getattr(obj, '_v_generations_evolved', False):
+                obj._p_changed = True
+                del obj._v_generations_evolved
+                pending += 1
+            if pending >= batch_size:
+                commit(pending)
+                pending = 0
+                tm.begin()
+        commit(pending)
+        if not complete:
+            logger.info('%s/%s: sweep incomplete', db_name, key)
+            return False
+
+        with tm:
+            generations = conn.root()[generations_key]
+            if generations.get(key) == start:
+                generations[key] = target
+                tm.get().note('%s: lazily evolved to generation %d'
+                              % (key, target))
+        logger.info('%s/%s: swept %d objects, now at generation %d',
+                    db_name, key, written, target)
+        return True
+    finally:
+        tm.abort()
+        conn.close()
@@ -0,0 +1,198 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Evolve a database while copying it into a new one.
+
+Evolving a big database in place writes new revisions of many objects,
+leaving the old ones behind until the database is packed, and makes
+all clients drop the objects from their caches.  `migrate` copies the
+current object records into an empty database instead, applying the
+state transforms (see
+`~zope.generations.interfaces.IStateSchemaManager`) of the pending
+evolution steps on the way, in big transactions.  The steps that
+follow are then done on the new database by
+`~zope.generations.generations.evolve`.
+"""
+import io
+import logging
+import os
+import tempfile
+
+import transaction
+import zope.component
+
+from .generations import EVOLVE
+from .generations import PersistentDict
+from .generations import evolve
+from .generations import generations_key
+from .generations import plan
+from .interfaces import ISchemaManager
+from .interfaces import IStateSchemaManager
+from .utility import _currentRecords
+from .utility import _storeRecords
+
+
+logger = logging.getLogger('zope.generations')
+
+
+class _Reference:
+    # Stands for a persistent reference in a state being transformed.
+
+    def __init__(self, reference):
+        self.reference = reference
+
+
+def _persistentId(obj):
+    if isinstance(obj, _Reference):
+        return obj.reference
+    return None
+
+
+def _stateTransforms(db, how):
+    # Return the state transforms for the evolution steps of *db* that
+    # can be done while copying, and the generations reached by them.
+    transforms = {}
+    generations = {}
+    for manager_plan in plan(db, how):
+        manager = zope.component.getUtility(ISchemaManager, manager_plan.key)
+        if not IStateSchemaManager.providedBy(manager):
+            continue
+        for step in manager_plan.steps:
+            step_transforms = manager.getStateTransforms(step.generation)
+            if step_transforms is None:
+                break
+            for name, transform in step_transforms.items():
+                transforms.setdefault(name, []).append(transform)
+            generations[manager_plan.key] = step.generation
+    return transforms, generations
+
+
+def _transformRecord(db, data, transforms):
+    # Apply the *transforms* to the state in the object record *data*.
+    from ZODB._compat import PersistentPickler
+    from ZODB._compat import PersistentUnpickler
+    from ZODB._compat import _protocol
+
+    def findGlobal(module, name):
+        return db.classFactory(None, module, name)
+
+    f = io.BytesIO(data)
+    unpickler = PersistentUnpickler(findGlobal, _Reference, f)
+    unpickler.load()
+    header = f.tell()
+    state = unpickler.load()
+    for transform in transforms:
+        state = transform(state)
+    # Keep the class pickle as it is.
+    f = io.BytesIO()
+    f.write(data[:header])
+    PersistentPickler(_persistentId, f, _protocol).dump(state)
+    return f.getvalue()
+
+
+def _copyBlob(source, destination, oid, tid):
+    # Copy the blob file of the record *tid* of *oid* to a temporary
+    # file, which storing it in *destination* moves into place.
+    from ZODB.utils import cp
+    fd, name = tempfile.mkstemp(
+        suffix='.tmp', dir=destination.temporaryDirectory())
+    with os.fdopen(fd, 'wb') as target:
+        with open(source.loadBlob(oid, tid), 'rb') as f:
+            cp(f, target)
+    return name
+
+
+def migrate(source, destination, how=EVOLVE, records=10000, **kw):
+    """Copy the database *source* into *destination*, evolving it.
+
+    *destination* has to be a new, empty database.  All current object
+    records of *source* are copied, *records* of them per transaction,
+    keeping their oids.  Before being written, the records of
+    objects whose classes have state transforms for the evolution steps
+    that *source* needs (see `~zope.generations.generations.plan`) are
+    transformed.  Each schema manager's steps are applied this way up to
+    the first one without state transforms.  The remaining steps are
+    then done by calling `~zope.generations.generations.evolve` with
+    *destination*, *how* and the keyword arguments given.
+
+    Like `~zope.generations.utility.findOidsByClass`, this copies the
+    objects no longer reachable but not packed away yet, too.  *source*
+    shouldn't be changed while it's copied.  The files of blobs are
+    copied with their records; if *destination* can't store blobs,
+    ``ValueError`` is raised when the first one is found.
+    """
+    from ZODB.blob import is_blob_record
+    from ZODB.interfaces import IBlobStorage
+    from ZODB.utils import get_pickle_metadata
+    from ZODB.utils import load_current
+    from ZODB.utils import z64
+
+    storage = destination.storage
+    if len(storage) > 1:
+        raise ValueError("The destination database isn't empty",
+                         destination)
+    root_serial = load_current(storage, z64)[1]
+
+    transforms, generations = _stateTransforms(source, how)
+    note = 'Copying from %s' % source.database_name
+    copied = transformed = 0
+    max_oid = z64
+    batch = []
+    blobs = {}
+    for oid, tid, data in _currentRecords(source.storage):
+        if is_blob_record(data):
+            if not IBlobStorage.providedBy(storage):
+                raise ValueError("The destination database can't store"
+                                 " blobs", destination)
+            blobs[oid] = _copyBlob(source.storage, storage, oid, tid)
+        name = '.'.join(get_pickle_metadata(data))
+        if name in transforms:
+            data = _transformRecord(source, data, transforms[name])
+            transformed += 1
+        batch.append((oid, root_serial if oid == z64 else z64, data))
+        max_oid = max(max_oid, oid)
+        if len(batch) >= records:
+            _storeRecords(destination, batch, note, blobs)
+            copied += len(batch)
+            batch = []
+            blobs = {}
+            logger.info('%s: copied %d records', source.database_name,
+                        copied)
+    if batch:
+        _storeRecords(destination, batch, note, blobs)
+        copied += len(batch)
+    logger.info('%s: copied %d records, %d of them transformed',
+                source.database_name, copied, transformed)
+
+    # New objects mustn't get the oids of the copied ones.
+    if hasattr(storage, 'set_max_oid'):
+        storage.set_max_oid(max_oid)
+    else:
+        while storage.new_oid() < max_oid:
+            pass
+
+    if generations:
+        tm = transaction.TransactionManager()
+        conn = destination.open(tm)
+        try:
+            with tm as tx:
+                tx.note('Recording the generations reached while copying')
+                root = conn.root()
+                stored = root.get(generations_key)
+                if stored is None:
+                    stored = root[generations_key] = PersistentDict()
+                stored.update(generations)
+        finally:
+            conn.close()
+
+    evolve(destination, how, **kw)
@@ -0,0 +1,350 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""The ``zope-generations`` command.
+
+It evolves a database outside of the application, for instance a
+replica before switching over to it::
+
+  zope-generations --file Data.fs --zcml generations.zcml status
+  zope-generations --zeo zeo.example.com:8100 --zcml generations.zcml \\
+      evolve --workers 4 --progress
+  zope-generations --file Data.fs --zcml generations.zcml \\
+      migrate Evolved.fs
+
+The ZCML files have to register the schema managers as
+`~zope.generations.interfaces.ISchemaManager` utilities.  Opening a
+ZEO server requires the ``ZEO`` package.  The ``migrate`` command
+evolves the database while copying it, see
+`zope.generations.migrate`.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+import transaction
+import zope.event
+
+from . import events
+from .generations import EVOLVE
+from .generations import EVOLVEMINIMUM
+from .generations import EVOLVENOT
+from .generations import evolve
+from .generations import findManagers
+from .generations import generations_key
+from .generations import old_generations_key
+from .generations import plan
+from .generations import prepareParallelEvolution
+from .interfaces import GenerationError
+
+
+modes = {
+    'evolve': EVOLVE,
+    'minimum': EVOLVEMINIMUM,
+    'not': EVOLVENOT,
+}
+
+
+def _addMode(command):
+    command.add_argument(
+        '--mode', choices=sorted(modes), default='evolve',
+        help='evolve to the current generations, only to the minimum'
+             ' generations or not at all (default: %(default)s)')
+
+
+def _addEvolveOptions(command):
+    command.add_argument(
+        '--workers', type=int, default=1, metavar='N',
+        help='evolve up to N schema managers in parallel, once the'
+             ' database was prepared for it with prepare-parallel')
+    command.add_argument(
+        '--batch-size', type=int, metavar='N',
+        help='objects a step changes before it commits or takes a'
+             ' savepoint')
+
+
+def _parser():
+    parser = argparse.ArgumentParser(
+        prog='zope-generations',
+        description='Show and evolve the generations of a ZODB database.')
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument(
+        '--file', metavar='PATH', help='open the FileStorage at PATH')
+    where.add_argument(
+        '--zeo', metavar='ADDRESS',
+        help='connect to the ZEO server at HOST:PORT or a Unix socket')
+    parser.add_argument(
+        '--storage', default='1', metavar='NAME',
+        help='name of the ZEO storage (default: %(default)s)')
+    parser.add_argument(
+        '--zcml', action='append', default=[], metavar='FILE',
+        help='load FILE to register the schema managers (repeatable)')
+    parser.add_argument(
+        '--cache-size', type=int, metavar='N',
+        help='number of objects cached per connection')
+    parser.add_argument(
+        '-v', '--verbose', action='count', default=0,
+        help='log more (repeatable)')
+
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser(
+        'status', help='show the generations of the database')
+    plan_command = commands.add_parser(
+        'plan', help='show the steps evolve would run')
+    _addMode(plan_command)
+    evolve_command = commands.add_parser(
+        'evolve', help='evolve the database')
+    _addMode(evolve_command)
+    _addEvolveOptions(evolve_command)
+    evolve_command.add_argument(
+        '--progress', action='store_true',
+        help='show the steps done and the estimated time left')
+    commands.add_parser(
+        'prepare-parallel',
+        help='convert the generations data so that schema managers can be'
+             ' evolved in parallel; older versions of zope.generations'
+             " can't evolve the database afterwards")
+    migrate_command = commands.add_parser(
+        'migrate', help='copy the database into a new FileStorage,'
+                        ' evolving it')
+    migrate_command.add_argument(
+        'destination', metavar='PATH',
+        help='the FileStorage to create')
+    _addMode(migrate_command)
+    _addEvolveOptions(migrate_command)
+    migrate_command.add_argument(
+        '--records', type=int, default=10000, metavar='N',
+        help='records copied per transaction (default: %(default)s)')
+    return parser
+
+
+def _open(options, read_only):
+    # Open the database given on the command line.
+    import ZODB
+    if options.file:
+        from ZODB.FileStorage import FileStorage
+        storage = FileStorage(options.file, read_only=read_only)
+    else:
+        import ZEO
+        address = options.zeo
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+            address = (host, int(port))
+        storage = ZEO.client(
+            address, storage=options.storage, read_only=read_only)
+    kw = {}
+    if options.cache_size is not None:
+        kw['cache_size'] = options.cache_size
+    return ZODB.DB(storage, **kw)
+
+
+def _loadZCML(paths):
+    from zope.configuration import xmlconfig
+    context = None
+    for path in paths:
+        context = xmlconfig.file(
+            os.path.abspath(path), context=context, execute=False)
+    if context is not None:
+        context.execute_actions()
+
+
+def _generations(db):
+    # Read the generations recorded in *db*.
+    tm = transaction.TransactionManager()
+    conn = db.open(tm)
+    try:
+        with tm:
+            root = conn.root()
+            generations = root.get(generations_key)
+            if generations is None:
+                generations = root.get(old_generations_key, {})
+            return dict(generations)
+    finally:
+        conn.close()
+
+
+def status(db, out):
+    """Write the generations of *db* and its schema managers to *out*."""
+    generations = _generations(db)
+    for key, manager in sorted(findManagers()):
+        current = generations.get(key)
+        if current is None:
+            state = 'not installed'
+        elif current > manager.generation:
+            state = 'too high'
+        elif current < manager.minimum_generation:
+            state = 'below minimum'
+        elif current < manager.generation:
+            state = 'evolvable'
+        else:
+            state = 'up to date'
+        print('{}: at {} (minimum {}, current {}), {}'.format(
+            key, '-' if current is None else current,
+            manager.minimum_generation, manager.generation, state),
+            file=out)
+
+
+def showPlan(db, how, out):
+    """Write the steps `evolve` would run for *db* to *out*."""
+    for manager_plan in plan(db, how):
+        if manager_plan.current is None:
+            print('{}: install generation {}'.format(
+                manager_plan.key, manager_plan.target), file=out)
+        elif not manager_plan.steps:
+            print('{}: up to date at generation {}'.format(
+                manager_plan.key, manager_plan.current), file=out)
+        else:
+            print('{}: generation {} to {}'.format(
+                manager_plan.key, manager_plan.current, manager_plan.target),
+                file=out)
+        for step in manager_plan.steps:
+            info = (step.info or '').strip().split('\n')[0]
+            print('  {}{}{}'.format(
+                step.generation, ' (required)' if step.required else '',
+                ': ' + info if info else ''), file=out)
+
+
+class Progress:
+    """Report the steps of an evolution to *out* as they progress.
+
+    *plans* are the `~zope.generations.generations.ManagerPlan` objects
+    of the evolution.  The time left is estimated from the average time
+    of the steps done.
+    """
+
+    def __init__(self, plans, out):
+        self.out = out
+        self.generations = {p.key: p.current for p in plans}
+        self.total = sum(len(p.steps) if p.current is not None else 1
+                         for p in plans)
+        self.done = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        if isinstance(event, events.EvolutionStepProgress):
+            self.stepProgress(event)
+        if not isinstance(event, events.EvolutionStepFinished):
+            return
+        with self.lock:
+            if event.error is not None:
+                print('{}: generation {} failed: {}'.format(
+                    event.key, event.generation, event.error),
+                    file=self.out, flush=True)
+                return
+            if isinstance(event, events.InstallFinished):
+                what = 'installed generation'
+                self.done += 1
+            else:
+                what = 'evolved to generation'
+                # A batch of transforms finishes several steps at once.
+                self.done += event.generation - (
+                    self.generations.get(event.key) or 0)
+            self.generations[event.key] = event.generation
+            elapsed = time.monotonic() - self.started
+            left = max(self.total - self.done, 0)
+            print('[{}/{}] {}: {} {} in {:.1f}s, about {} left'.format(
+                self.done, self.total, event.key, what, event.generation,
+                event.wall_time, _duration(elapsed / self.done * left)),
+                file=self.out, flush=True)
+
+    def stepProgress(self, event):
+        if event.eta is None:
+            done = f'{event.done} done'
+        else:
+            done = '{} of {} done, about {} left'.format(
+                event.done, event.total, _duration(event.eta))
+        print('  {}: generation {}: {}'.format(
+            event.key, event.generation, done), file=self.out, flush=True)
+
+    def __enter__(self):
+        zope.event.subscribers.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        zope.event.subscribers.remove(self)
+
+
+def copy(db, path, how, records, **kw):
+    """Copy *db* into a new FileStorage at *path*, evolving it.
+
+    The keyword arguments are passed to `evolve` for the steps done
+    after copying.
+    """
+    import ZODB
+    from ZODB.FileStorage import FileStorage
+
+    from .migrate import migrate
+    destination = ZODB.DB(FileStorage(path))
+    try:
+        migrate(db, destination, how, records, **kw)
+    finally:
+        destination.close()
+
+
+def _duration(seconds):
+    minutes, seconds = divmod(int(seconds + 0.5), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02}:{seconds:02}'
+
+
+def main(argv=None):
+    """Run the ``zope-generations`` command with *argv*.
+
+    Returns the exit status: 0 on success and 1 if the database can't
+    be evolved as asked.
+    """
+    out = sys.stdout
+    parser = _parser()
+    options = parser.parse_args(argv)
+    if options.command == 'migrate' and os.path.exists(options.destination):
+        parser.error(f'{options.destination} exists already')
+    logging.basicConfig(
+        level=max(logging.WARNING - 10 * options.verbose, logging.DEBUG),
+        format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    _loadZCML(options.zcml)
+
+    db = _open(options, read_only=options.command not in (
+        'evolve', 'prepare-parallel'))
+    try:
+        if options.command == 'status':
+            status(db, out)
+        elif options.command == 'plan':
+            showPlan(db, modes[options.mode], out)
+        elif options.command == 'prepare-parallel':
+            prepareParallelEvolution(db)
+        elif options.command == 'migrate':
+            copy(db, options.destination, modes[options.mode],
+                 options.records, workers=options.workers,
+                 batch_size=options.batch_size)
+        else:
+            how = modes[options.mode]
+            kw = dict(workers=options.workers, batch_size=options.batch_size)
+            if options.progress:
+                with Progress(plan(db, how), sys.stderr):
+                    evolve(db, how, **kw)
+            else:
+                evolve(db, how, **kw)
+    except GenerationError as e:
+        print(f'{type(e).__name__}: {e}', file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,9 +14,12 @@
 """Schema-generation tests."""
 
 import doctest
+import logging
 import unittest
 
+import persistent.list
 from zope.testing import cleanup
+from zope.testing import loggingsupport
 
 
 class TestSchemaManager(unittest.TestCase):
@@ -119,6 +122,1860 @@ class TestEvolve(cleanup.CleanUp,
         evolve(db, EVOLVEMINIMUM)
         self.assertEqual(manager.evolved, (2,))
 
+    def _makeManager(self, generation, minimum_generation=0):
+        from zope import interface
+        from zope.generations.interfaces import ISchemaManager
+
+        @interface.implementer(ISchemaManager)
+        class Manager:
+            evolved = ()
+
+            def evolve(self, context, generation):
+                self.evolved += (generation,)
+
+        manager = Manager()
+        manager.generation = generation
+        manager.minimum_generation = minimum_generation
+        return manager
+
+    def test_up_to_date_skips_managers(self):
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import ISchemaManager
+
+        manager = self._makeManager(1)
+        component.provideUtility(manager, ISchemaManager, name='app')
+        db = DB()
+        self.addCleanup(db.close)
+
+        def transaction_count():
+            return len(list(db.storage.iterator()))
+
+        # Once installed, nothing is written at all.
+        evolve(db)
+        count = transaction_count()
+        evolve(db)
+        self.assertEqual(transaction_count(), count)
+
+        # Until a manager changes.
+        manager.generation = 2
+        evolve(db)
+        self.assertEqual(manager.evolved, (2,))
+
+    def test_up_to_date_minimum(self):
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope.generations.generations import EVOLVEMINIMUM
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import ISchemaManager
+
+        manager = self._makeManager(1)
+        component.provideUtility(manager, ISchemaManager, name='app')
+        db = DB()
+        self.addCleanup(db.close)
+        evolve(db)
+        manager.generation = 2
+
+        # Generation 1 is good enough when evolving to the minimum...
+        evolve(db, EVOLVEMINIMUM)
+        self.assertEqual(manager.evolved, ())
+
+        # ...but not when evolving to the current generation.
+        evolve(db)
+        self.assertEqual(manager.evolved, (2,))
+
+    def test_up_to_date_evolved_by_newer_code(self):
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import GenerationTooHigh
+        from zope.generations.interfaces import ISchemaManager
+
+        db = DB()
+        self.addCleanup(db.close)
+        old = self._makeManager(1)
+        component.provideUtility(old, ISchemaManager, name='app')
+        evolve(db)
+
+        # Newer code evolves the database further.
+        component.provideUtility(self._makeManager(2), ISchemaManager,
+                                 name='app')
+        evolve(db)
+
+        # The old code starting again must not accept the database.
+        component.provideUtility(old, ISchemaManager, name='app')
+        with self.assertRaises(GenerationTooHigh):
+            evolve(db)
+
+    def test_read_only(self):
+        import os
+        import shutil
+        import tempfile
+
+        from ZODB import DB
+        from ZODB.FileStorage import FileStorage
+
+        from zope import component
+        from zope.generations.generations import EVOLVEMINIMUM
+        from zope.generations.generations import EVOLVENOT
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import ISchemaManager
+
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'Data.fs')
+        manager = self._makeManager(1)
+        component.provideUtility(manager, ISchemaManager, name='app')
+        db = DB(FileStorage(path))
+        evolve(db)
+        db.close()
+
+        # An up-to-date database is only read.
+        db = DB(FileStorage(path, read_only=True))
+        self.addCleanup(db.close)
+        for how in (EVOLVENOT, EVOLVEMINIMUM):
+            evolve(db, how)
+        manager.generation = 2
+        evolve(db, EVOLVEMINIMUM)
+
+    def _makeCacheFile(self):
+        import os
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        return os.path.join(tmpdir, 'generations.json')
+
+    def test_missing_evolver_detected_before_evolving(self):
+        import transaction
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope.generations.demo import key
+        from zope.generations.generations import SchemaManager
+        from zope.generations.generations import evolve
+        from zope.generations.generations import generations_key
+        from zope.generations.interfaces import ISchemaManager
+        from zope.generations.interfaces import UnableToEvolve
+
+        manager = SchemaManager(0, 1, 'zope.generations.demo')
+        component.provideUtility(manager, ISchemaManager, name='app')
+        db = DB()
+        self.addCleanup(db.close)
+        evolve(db)
+
+        def state():
+            conn = db.open()
+            with transaction.manager:
+                result = (conn.root()[key],
+                          conn.root()[generations_key]['app'])
+            conn.close()
+            return result
+
+        # There is no evolve4, so we don't even start with evolve2.
+        manager.generation = 4
+        loghandler = loggingsupport.InstalledHandler(
+            'zope.generations', level=logging.ERROR)
+        self.addCleanup(loghandler.uninstall)
+        evolve(db)
+        self.assertEqual(state(), (('installed',), 1))
+        self.assertEqual(loghandler.records[0].getMessage(),
+                         'unnamed/app: unable to evolve from generation'
+                         ' 1 to 4')
+
+        manager.minimum_generation = 4
+        with self.assertRaises(UnableToEvolve):
+            evolve(db)
+        self.assertEqual(state(), (('installed',), 1))
+
+        manager.generation = manager.minimum_generation = 3
+        evolve(db)
+        self.assertEqual(state(), (('installed', 2, 3), 3))
+
+    def test_cache_file_avoids_connection(self):
+        import transaction
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope.generations.generations import EVOLVEMINIMUM
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import ISchemaManager
+
+        manager = self._makeManager(1)
+        component.provideUtility(manager, ISchemaManager, name='app')
+        db = DB()
+        self.addCleanup(db.close)
+        cache_file = self._makeCacheFile()
+
+        # Install and then record the cache entry.
+        for _ in range(2):
+            evolve(db, cache_file=cache_file)
+
+        opened = []
+        db_open = db.open
+
+        def open_(*args, **kw):
+            opened.append(1)
+            return db_open(*args, **kw)
+        db.open = open_
+
+        evolve(db, cache_file=cache_file)
+        evolve(db, EVOLVEMINIMUM, cache_file=cache_file)
+        self.assertEqual(opened, [])
+
+        # Any commit invalidates the cache.
+        conn = db_open()
+        with transaction.manager:
+            conn.root()['x'] = 1
+        conn.close()
+        evolve(db, cache_file=cache_file)
+        self.assertEqual(opened, [1])
+
+        # As does a change of the schema managers.
+        evolve(db, cache_file=cache_file)
+        self.assertEqual(opened, [1])
+        manager.generation = 2
+        evolve(db, cache_file=cache_file)
+        self.assertEqual(opened, [1, 1])
+        self.assertEqual(manager.evolved, (2,))
+
+    def test_cache_file_from_environment(self):
+        import os
+        from unittest import mock
+
+        from ZODB.MappingStorage import DB
+
+        from zope.generations.generations import cache_file_variable
+        from zope.generations.generations import evolve
+
+        db = DB(database_name='testdb')
+        self.addCleanup(db.close)
+        cache_file = self._makeCacheFile()
+        with mock.patch.dict(os.environ, {cache_file_variable: cache_file}):
+            evolve(db)
+        with open(cache_file) as f:
+            self.assertIn('testdb', f.read())
+
+    def test_cache_file_unusable(self):
+        import os
+
+        from ZODB.MappingStorage import DB
+
+        from zope.generations.generations import evolve
+
+        db = DB()
+        self.addCleanup(db.close)
+        cache_file = self._makeCacheFile()
+        with open(cache_file, 'w') as f:
+            f.write('not json')
+        evolve(db, cache_file=cache_file)
+        # A directory can't be written to, which is logged but not fatal.
+        loghandler = loggingsupport.InstalledHandler(
+            'zope.generations', level=logging.WARNING)
+        self.addCleanup(loghandler.uninstall)
+        tmpdir = os.path.dirname(cache_file)
+        evolve(db, cache_file=tmpdir)
+        self.assertEqual(len(loghandler.records), 1)
+        self.assertFalse(os.path.exists('%s.%d.tmp' % (tmpdir, os.getpid())))
+
+
+def _makeFileStorageDB(test):
+    # Unlike MappingStorage, FileStorage supports conflict resolution.
+    import os
+    import shutil
+    import tempfile
+
+    import ZODB
+    import ZODB.FileStorage
+    tmpdir = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, tmpdir)
+    db = ZODB.DB(ZODB.FileStorage.FileStorage(
+        os.path.join(tmpdir, 'Data.fs')))
+    test.addCleanup(db.close)
+    return db
+
+
+class TestSchedule(unittest.TestCase):
+
+    def _callFUT(self, managers):
+        from zope.generations.generations import _schedule
+        return [(key, sorted(deps)) for key, manager, deps
+                in _schedule(sorted(managers.items()))]
+
+    def _makeManager(self, depends_on=None):
+        from zope import interface
+        from zope.generations.interfaces import IDependentSchemaManager
+        from zope.generations.interfaces import ISchemaManager
+
+        manager = interface.implementer(ISchemaManager)(type(
+            'Manager', (), {'generation': 0, 'minimum_generation': 0}))()
+        if depends_on is not None:
+            interface.alsoProvides(manager, IDependentSchemaManager)
+            manager.depends_on = depends_on
+        return manager
+
+    def test_name_order(self):
+        managers = {name: self._makeManager() for name in 'cab'}
+        self.assertEqual(self._callFUT(managers),
+                         [('a', []), ('b', ['a']), ('c', ['b'])])
+
+    def test_dependencies(self):
+        managers = {
+            'a': self._makeManager(depends_on=('d', 'unknown')),
+            'b': self._makeManager(),
+            'c': self._makeManager(depends_on=()),
+            'd': self._makeManager(),
+        }
+        self.assertEqual(self._callFUT(managers), [
+            ('b', []), ('c', []), ('d', ['b']), ('a', ['d'])])
+
+    def test_circular_dependencies(self):
+        from zope.generations.interfaces import GenerationError
+        managers = {
+            'a': self._makeManager(depends_on=('b',)),
+            'b': self._makeManager(depends_on=('a',)),
+            'c': self._makeManager(),
+        }
+        with self.assertRaises(GenerationError) as exc:
+            self._callFUT(managers)
+        self.assertEqual(exc.exception.args[1], ['a', 'b'])
+
+
+class TestGenerationsMapping(unittest.TestCase):
+
+    def setUp(self):
+        import transaction
+
+        from zope.generations.generations import GenerationsMapping
+        self.db = _makeFileStorageDB(self)
+        self.tm1 = transaction.TransactionManager()
+        self.tm2 = transaction.TransactionManager()
+        self.conn1 = self.db.open(self.tm1)
+        self.conn2 = self.db.open(self.tm2)
+        with self.tm1:
+            self.conn1.root()['g'] = GenerationsMapping({'a': 1, 'b': 1})
+
+    def tearDown(self):
+        self.tm1.abort()
+        self.tm2.abort()
+
+    def _change(self, **changes):
+        self.tm1.begin()
+        self.tm2.begin()
+        for tm, conn, (key, value) in zip(
+                (self.tm1, self.tm2), (self.conn1, self.conn2),
+                changes.items()):
+            if value is None:
+                del conn.root()['g'][key.rstrip('_')]
+            else:
+                conn.root()['g'][key.rstrip('_')] = value
+        self.tm1.commit()
+        self.tm2.commit()
+        self.tm1.begin()
+        return dict(self.conn1.root()['g'])
+
+    def test_different_keys(self):
+        self.assertEqual(self._change(a=2, c=1), {'a': 2, 'b': 1, 'c': 1})
+        self.assertEqual(self._change(a=None, b=2), {'b': 2, 'c': 1})
+
+    def test_same_key(self):
+        from ZODB.POSException import ConflictError
+        self.assertEqual(self._change(a=2, a_=2), {'a': 2, 'b': 1})
+        with self.assertRaises(ConflictError):
+            self._change(a=3, a_=4)
+
+
+class TestEvolveInParallel(cleanup.CleanUp,
+                           unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        import transaction
+
+        from zope.generations.generations import prepareParallelEvolution
+        self.db = _makeFileStorageDB(self)
+        self.events = []
+        conn = self.db.open()
+        with transaction.manager:
+            # Every manager works on its own persistent object.
+            for name in 'abcd':
+                conn.root()[name] = persistent.list.PersistentList()
+        conn.close()
+        prepareParallelEvolution(self.db)
+
+    def _makeManager(self, name, generation, minimum_generation=0,
+                     depends_on=None, barrier=None, erron=None):
+        from zope import component
+        from zope import interface
+        from zope.generations.interfaces import IDependentSchemaManager
+        from zope.generations.interfaces import IInstallableSchemaManager
+
+        events = self.events
+
+        @interface.implementer(IInstallableSchemaManager)
+        class Manager:
+
+            def install(self, context):
+                pass
+
+            def evolve(self, context, generation):
+                if barrier is not None:
+                    barrier.wait()
+                if generation == erron:
+                    raise ValueError(generation)
+                context.connection.root()[name].append(generation)
+                events.append((name, generation))
+
+        manager = Manager()
+        manager.generation = generation
+        manager.minimum_generation = minimum_generation
+        if depends_on is not None:
+            interface.alsoProvides(manager, IDependentSchemaManager)
+            manager.depends_on = depends_on
+        component.provideUtility(manager, IInstallableSchemaManager, name)
+        return manager
+
+    def _generations(self):
+        import transaction
+
+        from zope.generations.generations import generations_key
+        conn = self.db.open()
+        with transaction.manager:
+            result = dict(conn.root()[generations_key])
+            lists = {name: list(conn.root()[name]) for name in 'abcd'}
+        conn.close()
+        return result, lists
+
+    def test_independent_managers_run_concurrently(self):
+        import threading
+
+        from zope.generations.generations import GenerationsMapping
+        from zope.generations.generations import evolve
+        from zope.generations.generations import generations_key
+
+        self._makeManager('a', 0, depends_on=())
+        self._makeManager('b', 0, depends_on=())
+        c = self._makeManager('c', 0, depends_on=('a', 'b'))
+        d = self._makeManager('d', 0)
+        evolve(self.db, workers=4)
+
+        # Both a and b have to reach the barrier before either continues.
+        barrier = threading.Barrier(2, timeout=10)
+        self._makeManager('a', 2, depends_on=(), barrier=barrier)
+        self._makeManager('b', 2, depends_on=(), barrier=barrier)
+        c.generation = d.generation = 1
+        evolve(self.db, workers=4)
+
+        generations, lists = self._generations()
+        self.assertEqual(generations, {'a': 2, 'b': 2, 'c': 1, 'd': 1})
+        self.assertEqual(lists, {'a': [1, 2], 'b': [1, 2],
+                                 'c': [1], 'd': [1]})
+        # c waits for a and b
+        self.assertGreater(self.events.index(('c', 1)),
+                           self.events.index(('a', 2)))
+        self.assertGreater(self.events.index(('c', 1)),
+                           self.events.index(('b', 2)))
+
+        conn = self.db.open()
+        self.assertIsInstance(conn.root()[generations_key],
+                              GenerationsMapping)
+        conn.close()
+
+    def _makeConflictingManagers(self):
+        import threading
+
+        from zope import component
+        from zope import interface
+        from zope.generations.interfaces import IDependentSchemaManager
+        from zope.generations.interfaces import IInstallableSchemaManager
+
+        # Both installs add to the root at the same time the first time.
+        barrier = threading.Barrier(2, timeout=10)
+
+        @interface.implementer(IInstallableSchemaManager,
+                               IDependentSchemaManager)
+        class Manager:
+            generation = 1
+            minimum_generation = 0
+            depends_on = ()
+
+            def __init__(self, name):
+                self.name = name
+                self.installs = 0
+
+            def install(self, context):
+                self.installs += 1
+                if self.installs == 1:
+                    barrier.wait()
+                context.connection.root()['installed-' + self.name] = True
+
+        managers = [Manager('x'), Manager('y')]
+        for manager in managers:
+            component.provideUtility(
+                manager, IInstallableSchemaManager, manager.name)
+        return managers
+
+    def test_conflicting_installs_are_retried(self):
+        from zope.generations.generations import evolve
+
+        managers = self._makeConflictingManagers()
+        evolve(self.db, workers=2)
+
+        self.assertEqual(sorted(m.installs for m in managers), [1, 2])
+        conn = self.db.open()
+        self.assertTrue(conn.root()['installed-x'])
+        self.assertTrue(conn.root()['installed-y'])
+        conn.close()
+
+    def test_no_retries(self):
+        from ZODB.POSException import ConflictError
+
+        from zope.generations.generations import evolve
+
+        managers = self._makeConflictingManagers()
+        with self.assertRaises(ConflictError):
+            evolve(self.db, workers=2, retries=0)
+        self.assertEqual([m.installs for m in managers], [1, 1])
+
+    def test_not_prepared(self):
+        import threading
+
+        from ZODB.MappingStorage import DB
+
+        from zope.generations.generations import GenerationsMapping
+        from zope.generations.generations import evolve
+        from zope.generations.generations import generations_key
+
+        db = DB()
+        self.addCleanup(db.close)
+        self._makeManager('a', 0, depends_on=())
+        self._makeManager('b', 0, depends_on=())
+        evolve(db, workers=2)
+        # Without being prepared, the managers are evolved one at a time,
+        # so both waiting at the barrier would time out.
+        barrier = threading.Barrier(2, timeout=0.1)
+        self._makeManager('a', 1, depends_on=(), barrier=barrier)
+        self._makeManager('b', 1, depends_on=())
+        evolve(db, workers=2)
+        self.assertTrue(barrier.broken)
+        conn = db.open()
+        self.assertNotIsInstance(conn.root()[generations_key],
+                                 GenerationsMapping)
+        conn.close()
+
+    def test_error_stops_scheduling(self):
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import UnableToEvolve
+
+        a = self._makeManager('a', 0, depends_on=())
+        b = self._makeManager('b', 0, depends_on=('a',))
+        evolve(self.db, workers=2)
+        a.generation = a.minimum_generation = 1
+        a.evolve = lambda context, generation: 1 / 0
+        b.generation = 1
+
+        with self.assertRaises(UnableToEvolve):
+            evolve(self.db, workers=2)
+        generations, lists = self._generations()
+        self.assertEqual(generations, {'a': 0, 'b': 0})
+
+    def test_failure_above_minimum_continues(self):
+        from zope.generations.generations import evolve
+
+        self._makeManager('a', 0, depends_on=())
+        self._makeManager('b', 0, depends_on=('a',))
+        evolve(self.db, workers=2)
+        self._makeManager('a', 3, depends_on=(), erron=2)
+        self._makeManager('b', 1, depends_on=('a',))
+        evolve(self.db, workers=2)
+        generations, lists = self._generations()
+        self.assertEqual(generations, {'a': 1, 'b': 1})
+
+
+class TestCheckpoint(cleanup.CleanUp,
+                     unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope import interface
+        from zope.generations.interfaces import ISchemaManager
+
+        test = self
+        self.db = DB()
+        self.addCleanup(self.db.close)
+        self.fail_at = None
+        self.cursors = []
+        self.batch_sizes = []
+
+        @interface.implementer(ISchemaManager)
+        class Manager:
+            generation = 0
+            minimum_generation = 0
+
+            def evolve(self, context, generation):
+                # Process the items 0 to 9, committing after every third.
+                test.cursors.append(context.cursor)
+                test.batch_sizes.append(context.batch_size)
+                root = context.connection.root()
+                start = 0 if context.cursor is None else context.cursor
+                for i in range(start, 10):
+                    if i == test.fail_at:
+                        raise ValueError(i)
+                    root['done'] = root.get('done', ()) + ((generation, i),)
+                    if i % 3 == 2:
+                        context.checkpoint(i + 1)
+
+        self.manager = Manager()
+        component.provideUtility(self.manager, ISchemaManager, name='app')
+
+    def _root(self):
+        import transaction
+        conn = self.db.open()
+        self.addCleanup(conn.close)
+        transaction.begin()
+        self.addCleanup(transaction.abort)
+        return conn.root()
+
+    def test_resume_from_checkpoint(self):
+        from zope.generations.generations import evolve
+        from zope.generations.generations import generations_key
+        from zope.generations.generations import progress_key
+        from zope.generations.interfaces import UnableToEvolve
+
+        evolve(self.db)
+        self.manager.generation = 2
+        self.manager.minimum_generation = 1
+        self.fail_at = 7
+        with self.assertRaises(UnableToEvolve):
+            evolve(self.db)
+        # The work up to the last checkpoint was committed anyway.
+        root = self._root()
+        self.assertEqual(root['done'], tuple((1, i) for i in range(6)))
+        self.assertEqual(root[generations_key]['app'], 0)
+        self.assertEqual(dict(root[progress_key]), {'app': (1, 6)})
+
+        self.fail_at = None
+        evolve(self.db)
+        root = self._root()
+        self.assertEqual(root['done'], tuple((1, i) for i in range(10))
+                         + tuple((2, i) for i in range(10)))
+        self.assertEqual(root[generations_key]['app'], 2)
+        self.assertEqual(dict(root[progress_key]), {})
+        self.assertEqual(self.cursors, [None, 6, None])
+
+    def test_no_checkpoints(self):
+        from zope.generations.generations import evolve
+        from zope.generations.generations import progress_key
+
+        evolve(self.db)
+        self.manager.generation = 1
+        self.manager.evolve = lambda context, generation: None
+        evolve(self.db)
+        # Only steps recording checkpoints store the progress mapping.
+        self.assertNotIn(progress_key, self._root())
+
+    def test_stale_checkpoint_ignored(self):
+        import transaction
+
+        from zope.generations.generations import PersistentDict
+        from zope.generations.generations import evolve
+        from zope.generations.generations import progress_key
+
+        evolve(self.db)
+        with transaction.manager:
+            progress = self._root()[progress_key] = PersistentDict()
+            progress['app'] = (5, 3)
+        self.manager.generation = 1
+        evolve(self.db)
+        self.assertEqual(self.cursors, [None])
+
+    def test_in_batches(self):
+        from zope.generations.generations import evolve
+        from zope.generations.generations import generations_key
+        from zope.generations.interfaces import UnableToEvolve
+        from zope.generations.utility import inBatches
+
+        def evolve_(context, generation):
+            root = context.connection.root()
+            for batch in inBatches(context, range(10), size=3, commit=True,
+                                   target_time=60, max_size=3):
+                if batch[0] == self.fail_at:
+                    raise ValueError(batch)
+                root['done'] = root.get('done', ()) + tuple(batch)
+
+        self.manager.evolve = evolve_
+        evolve(self.db)
+        self.manager.generation = self.manager.minimum_generation = 1
+        self.fail_at = 6
+        with self.assertRaises(UnableToEvolve):
+            evolve(self.db)
+        self.assertEqual(self._root()['done'], tuple(range(6)))
+
+        self.fail_at = None
+        evolve(self.db)
+        root = self._root()
+        self.assertEqual(root['done'], tuple(range(10)))
+        self.assertEqual(root[generations_key]['app'], 1)
+
+    def test_batch_size(self):
+        from zope.generations.generations import evolve
+
+        evolve(self.db)
+        self.manager.generation = 2
+        evolve(self.db, batch_size=3)
+        self.manager.generation = 3
+        evolve(self.db)
+        self.assertEqual(self.batch_sizes, [3, 3, 10000])
+
+    def test_checkpoint_outside_evolve(self):
+        from zope.generations.generations import Context
+        with self.assertRaises(TypeError):
+            Context().checkpoint(1)
+
+
+class TestSquash(cleanup.CleanUp,
+                 unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope import interface
+        from zope.generations.interfaces import ISchemaManager
+
+        test = self
+        self.db = DB()
+        self.addCleanup(self.db.close)
+        self.fail_at = None
+
+        @interface.implementer(ISchemaManager)
+        class Manager:
+            generation = 0
+            minimum_generation = 0
+
+            def evolve(self, context, generation):
+                root = context.connection.root()
+                root['done'] = root.get('done', ()) + (generation,)
+                if generation == test.fail_at:
+                    raise ValueError(generation)
+
+        self.manager = Manager()
+        component.provideUtility(self.manager, ISchemaManager, name='app')
+
+    def _descriptions(self):
+        return [t.description for t in self.db.storage.iterator()]
+
+    def _root(self):
+        import transaction
+        conn = self.db.open()
+        self.addCleanup(conn.close)
+        transaction.begin()
+        self.addCleanup(transaction.abort)
+        return conn.root()
+
+    def test_one_transaction(self):
+        from zope.generations.generations import evolve
+        from zope.generations.generations import generations_key
+
+        evolve(self.db)
+        before = len(self._descriptions())
+        self.manager.generation = 5
+        evolve(self.db, squash=True)
+        descriptions = self._descriptions()
+        self.assertEqual(len(descriptions), before + 1)
+        self.assertEqual(
+            descriptions[-1].decode(),
+            '\n'.join('app: evolving to generation %d' % g
+                      for g in range(1, 6)))
+        root = self._root()
+        self.assertEqual(root['done'], (1, 2, 3, 4, 5))
+        self.assertEqual(root[generations_key]['app'], 5)
+
+    def test_failure_keeps_previous_steps(self):
+        from zope.generations.generations import evolve
+        from zope.generations.generations import generations_key
+
+        evolve(self.db)
+        before = len(self._descriptions())
+        self.manager.generation = 5
+        self.fail_at = 4
+        evolve(self.db, squash=True)
+        self.assertEqual(len(self._descriptions()), before + 1)
+        root = self._root()
+        self.assertEqual(root['done'], (1, 2, 3))
+        self.assertEqual(root[generations_key]['app'], 3)
+
+    def test_failure_in_first_step(self):
+        from zope.generations.generations import evolve
+        from zope.generations.generations import generations_key
+
+        evolve(self.db)
+        before = len(self._descriptions())
+        self.manager.generation = 5
+        self.fail_at = 1
+        evolve(self.db, squash=True)
+        self.assertEqual(len(self._descriptions()), before)
+        root = self._root()
+        self.assertNotIn('done', root)
+        self.assertEqual(root[generations_key]['app'], 0)
+
+    def test_marker_interface(self):
+        from zope import interface
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import ISquashableSchemaManager
+
+        evolve(self.db)
+        before = len(self._descriptions())
+        interface.alsoProvides(self.manager, ISquashableSchemaManager)
+        self.manager.generation = 3
+        evolve(self.db)
+        self.assertEqual(len(self._descriptions()), before + 1)
+
+
+class TestBatch(cleanup.CleanUp,
+                unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        import transaction
+        from persistent.mapping import PersistentMapping
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope import interface
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import IBatchSchemaManager
+        from zope.generations.interfaces import ISchemaManager
+
+        test = self
+        self.db = DB()
+        self.addCleanup(self.db.close)
+        self.visits = []
+        self.fail_at = None
+
+        def makeTransform(generation):
+            def transform(obj):
+                test.visits.append(generation)
+                if generation == test.fail_at:
+                    raise ValueError(generation)
+                if isinstance(obj, PersistentMapping) and 'n' in obj:
+                    obj['n'] += (generation,)
+            return transform
+
+        @interface.implementer(IBatchSchemaManager)
+        class Manager:
+            generation = 0
+            minimum_generation = 0
+            transforms = (1, 2, 4)
+
+            def evolve(self, context, generation):
+                test.visits.append('evolve %d' % generation)
+
+            def getTransform(self, generation):
+                if generation in self.transforms:
+                    return makeTransform(generation)
+
+        self.manager = Manager()
+        component.provideUtility(self.manager, ISchemaManager, name='app')
+        evolve(self.db)
+        conn = self.db.open()
+        with transaction.manager:
+            root = conn.root()
+            for i in range(3):
+                root[i] = PersistentMapping(n=())
+        conn.close()
+
+    def _root(self):
+        import transaction
+        conn = self.db.open()
+        self.addCleanup(conn.close)
+        transaction.begin()
+        self.addCleanup(transaction.abort)
+        return conn.root()
+
+    def _descriptions(self):
+        return [t.description.decode() for t in self.db.storage.iterator()]
+
+    def test_consecutive_transforms_fused(self):
+        from zope.generations.generations import evolve
+        from zope.generations.generations import generations_key
+
+        before = len(self._descriptions())
+        self.manager.generation = 4
+        evolve(self.db)
+        # The root, its three children and the generations data are
+        # visited in two passes, one for 1 and 2 and one for 4.
+        self.assertEqual(self.visits.count(1), self.visits.count(4))
+        self.assertEqual(
+            self.visits.index('evolve 3'), 2 * self.visits.count(1))
+        self.assertEqual(self.visits[:2], [1, 2])
+        descriptions = self._descriptions()[before:]
+        self.assertEqual(descriptions, [
+            'app: evolving to generation 1\napp: evolving to generation 2',
+            'app: evolving to generation 3',
+            'app: evolving to generation 4',
+        ])
+        root = self._root()
+        self.assertEqual([root[i]['n'] for i in range(3)], [(1, 2, 4)] * 3)
+        self.assertEqual(root[generations_key]['app'], 4)
+
+    def test_failing_transform(self):
+        from zope.generations.generations import evolve
+        from zope.generations.generations import generations_key
+        from zope.generations.interfaces import UnableToEvolve
+
+        self.manager.generation = 2
+        self.manager.minimum_generation = 1
+        self.fail_at = 2
+        with self.assertRaises(UnableToEvolve) as cm:
+            evolve(self.db)
+        self.assertEqual(cm.exception.args[0], 1)
+        root = self._root()
+        self.assertEqual([root[i]['n'] for i in range(3)], [()] * 3)
+        self.assertEqual(root[generations_key]['app'], 0)
+
+    def test_schema_manager(self):
+        import sys
+        import types
+
+        from zope.generations.generations import Context
+        from zope.generations.generations import SchemaManager
+
+        package = 'zope.generations.tests.batchdemo'
+
+        def transform(obj):
+            "Count"
+            if hasattr(obj, 'get') and 'n' in obj:
+                obj['n'] += ('t',)
+
+        modules = {package: types.ModuleType(package)}
+        modules[package + '.evolve1'] = evolve1 = types.ModuleType('evolve1')
+        evolve1.transform = transform
+        self.addCleanup(lambda: [sys.modules.pop(name) for name in modules])
+        sys.modules.update(modules)
+
+        manager = SchemaManager(0, 1, package)
+        self.assertIs(manager.getTransform(1), transform)
+        self.assertEqual(manager.getInfo(1), 'Count')
+        # Called directly, the transform is applied to the whole database.
+        context = Context()
+        context.connection = self._root()._p_jar
+        manager.evolve(context, 1)
+        root = context.connection.root()
+        self.assertEqual([root[i]['n'] for i in range(3)], [('t',)] * 3)
+
+
+class TestPlan(cleanup.CleanUp,
+               unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope.generations.generations import SchemaManager
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import ISchemaManager
+
+        self.db = DB()
+        self.addCleanup(self.db.close)
+        self.manager = SchemaManager(0, 0, 'zope.generations.demo')
+        component.provideUtility(self.manager, ISchemaManager, name='demo')
+        evolve(self.db)
+        self.manager.minimum_generation = 2
+        self.manager.generation = 3
+
+    def _lastTransaction(self):
+        return self.db.lastTransaction()
+
+    def test_plan(self):
+        from zope.generations.generations import ManagerPlan
+        from zope.generations.generations import PlannedStep
+        from zope.generations.generations import plan
+
+        tid = self._lastTransaction()
+        self.assertEqual(plan(self.db), [
+            ManagerPlan('demo', 0, 3, (
+                PlannedStep(1, 'Evolver 1', True),
+                PlannedStep(2, 'Evolver 2', True),
+                PlannedStep(3, None, False),
+            )),
+        ])
+        self.assertEqual(self._lastTransaction(), tid)
+
+    def test_plan_minimum(self):
+        from zope.generations.generations import EVOLVEMINIMUM
+        from zope.generations.generations import plan
+
+        [manager_plan] = plan(self.db, EVOLVEMINIMUM)
+        self.assertEqual(manager_plan.target, 2)
+        self.assertEqual([s.generation for s in manager_plan.steps], [1, 2])
+
+    def test_plan_evolvenot(self):
+        from zope.generations.generations import EVOLVENOT
+        from zope.generations.generations import plan
+        from zope.generations.interfaces import GenerationTooLow
+
+        with self.assertRaises(GenerationTooLow):
+            plan(self.db, EVOLVENOT)
+        self.manager.minimum_generation = 0
+        [manager_plan] = plan(self.db, EVOLVENOT)
+        self.assertEqual(manager_plan.target, 0)
+        self.assertEqual(manager_plan.steps, ())
+
+    def test_plan_install(self):
+        from zope import component
+        from zope.generations.generations import ManagerPlan
+        from zope.generations.generations import SchemaManager
+        from zope.generations.generations import plan
+        from zope.generations.interfaces import ISchemaManager
+
+        component.provideUtility(
+            SchemaManager(0, 5, 'zope.generations.demo'), ISchemaManager,
+            name='new')
+        self.assertEqual(plan(self.db)[1], ManagerPlan('new', None, 5, ()))
+
+    def test_plan_too_high(self):
+        import transaction
+
+        from zope.generations.generations import generations_key
+        from zope.generations.generations import plan
+        from zope.generations.interfaces import GenerationTooHigh
+
+        conn = self.db.open()
+        with transaction.manager:
+            conn.root()[generations_key]['demo'] = 4
+        conn.close()
+        with self.assertRaises(GenerationTooHigh):
+            plan(self.db)
+
+
+class TestEvents(cleanup.CleanUp,
+                 unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        import zope.event
+        from persistent.mapping import PersistentMapping
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope import interface
+        from zope.generations.interfaces import IInstallableSchemaManager
+        from zope.generations.interfaces import ISchemaManager
+
+        test = self
+        self.db = DB()
+        self.addCleanup(self.db.close)
+        self.events = []
+        zope.event.subscribers.append(self.events.append)
+        self.addCleanup(zope.event.subscribers.remove, self.events.append)
+        self.fail_at = None
+
+        @interface.implementer(IInstallableSchemaManager)
+        class Manager:
+            generation = 1
+            minimum_generation = 0
+
+            def install(self, context):
+                context.connection.root()['data'] = PersistentMapping()
+
+            def evolve(self, context, generation):
+                if generation == test.fail_at:
+                    raise ValueError(generation)
+                data = context.connection.root()['data']
+                data[generation] = PersistentMapping(x='x' * 1000)
+                context.checkpoint(None)
+                data[generation, 'b'] = PersistentMapping()
+
+        self.manager = Manager()
+        component.provideUtility(self.manager, ISchemaManager, name='app')
+
+    def _names(self):
+        return [(type(e).__name__, getattr(e, 'generation', None))
+                for e in self.events]
+
+    def test_install(self):
+        from zope.generations.generations import EVOLVE
+        from zope.generations.generations import evolve
+
+        evolve(self.db)
+        self.assertEqual(self._names(), [
+            ('EvolutionStarted', None),
+            ('InstallStarted', 1),
+            ('InstallFinished', 1),
+            ('EvolutionFinished', None),
+        ])
+        started, _, installed, finished = self.events
+        self.assertIs(started.database, self.db)
+        self.assertEqual(started.how, EVOLVE)
+        self.assertEqual(installed.key, 'app')
+        self.assertIs(installed.manager, self.manager)
+        # The root, the generations data and the new mapping.
+        self.assertEqual(installed.objects, 3)
+        self.assertGreater(installed.size, 0)
+        self.assertGreaterEqual(installed.wall_time, 0)
+        self.assertGreaterEqual(installed.cpu_time, 0)
+        self.assertEqual(installed.retries, 0)
+        self.assertIsNone(installed.error)
+        self.assertIsNone(finished.error)
+        self.assertGreaterEqual(finished.wall_time, 0)
+
+    def test_steps(self):
+        from zope.generations.generations import evolve
+
+        evolve(self.db)
+        del self.events[:]
+        self.manager.generation = 3
+        evolve(self.db)
+        self.assertEqual(self._names(), [
+            ('EvolutionStarted', None),
+            ('EvolutionStepStarted', 2),
+            ('EvolutionStepFinished', 2),
+            ('EvolutionStepStarted', 3),
+            ('EvolutionStepFinished', 3),
+            ('EvolutionFinished', None),
+        ])
+        step = self.events[2]
+        # Both transactions of the step are counted: the checkpoint
+        # stores data, the new mapping, the progress and the root which
+        # now holds it; the last one data, the other mapping, the
+        # progress and the generations.
+        self.assertEqual(step.objects, 8)
+        self.assertGreater(step.size, 1000)
+        self.assertIsNone(step.error)
+
+    def test_squash(self):
+        from zope.generations.generations import evolve
+
+        evolve(self.db)
+        del self.events[:]
+        self.manager.generation = 3
+        self.manager.evolve = lambda context, generation: None
+        evolve(self.db, squash=True)
+        self.assertIsNone(self.events[2].objects)
+        self.assertEqual(self.events[4].objects, 1)
+
+    def test_failure(self):
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import UnableToEvolve
+
+        evolve(self.db)
+        del self.events[:]
+        self.manager.generation = self.manager.minimum_generation = 2
+        self.fail_at = 2
+        with self.assertRaises(UnableToEvolve) as cm:
+            evolve(self.db)
+        step, finished = self.events[2:]
+        self.assertIsInstance(step.error, ValueError)
+        self.assertIsNone(step.objects)
+        self.assertIs(finished.error, cm.exception)
+
+    def test_no_events_when_up_to_date_according_to_cache(self):
+        import os
+        import tempfile
+
+        from zope.generations.generations import evolve
+
+        cache_file = os.path.join(tempfile.mkdtemp(), 'cache.json')
+        self.addCleanup(os.rmdir, os.path.dirname(cache_file))
+        self.addCleanup(os.remove, cache_file)
+        # Install and then record the cache entry.
+        for _ in range(2):
+            evolve(self.db, cache_file=cache_file)
+        del self.events[:]
+        evolve(self.db, cache_file=cache_file)
+        self.assertEqual(self.events, [])
+
+
+class TestProfile(cleanup.CleanUp,
+                  unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        import shutil
+        import tempfile
+
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope import interface
+        from zope.generations.interfaces import ISchemaManager
+
+        self.db = DB()
+        self.addCleanup(self.db.close)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        @interface.implementer(ISchemaManager)
+        class Manager:
+            generation = 0
+            minimum_generation = 0
+
+            def evolve(self, context, generation):
+                context.connection.root()[generation] = [0] * 1000
+
+        self.manager = Manager()
+        component.provideUtility(self.manager, ISchemaManager, name='app')
+
+    def _evolve(self, **kw):
+        from zope.generations.generations import evolve
+
+        evolve(self.db, **kw)
+        self.manager.generation = 2
+        evolve(self.db, **kw)
+
+    def test_profile(self):
+        import os
+        import pstats
+
+        self._evolve(profile_dir=self.directory)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['app-1.prof', 'app-2.prof', 'app-install.prof'])
+        stats = pstats.Stats(os.path.join(self.directory, 'app-1.prof'))
+        self.assertIn('evolve', {func[2] for func in stats.stats})
+
+    def test_trace_memory(self):
+        import os
+        import tracemalloc
+
+        directory = os.path.join(self.directory, 'new')
+        self._evolve(profile_dir=directory, trace_memory=True)
+        self.assertEqual(sorted(os.listdir(directory)), [
+            'app-1.memory.txt', 'app-1.prof',
+            'app-2.memory.txt', 'app-2.prof',
+            'app-install.memory.txt', 'app-install.prof',
+        ])
+        self.assertFalse(tracemalloc.is_tracing())
+        with open(os.path.join(directory, 'app-1.memory.txt')) as f:
+            self.assertIn('test_generations.py', f.read())
+
+    def test_environment(self):
+        import os
+
+        from zope.generations.generations import profile_dir_variable
+        from zope.generations.generations import trace_memory_variable
+
+        os.environ[profile_dir_variable] = self.directory
+        os.environ[trace_memory_variable] = '1'
+        self.addCleanup(os.environ.pop, profile_dir_variable)
+        self.addCleanup(os.environ.pop, trace_memory_variable)
+        self._evolve()
+        self.assertIn('app-2.memory.txt', os.listdir(self.directory))
+
+
+class TestBackground(cleanup.CleanUp,
+                     unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        import threading
+
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope import interface
+        from zope.generations import generations
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import ISchemaManager
+
+        test = self
+        self.db = DB()
+        self.addCleanup(self.db.close)
+        self.fail_at = None
+        self.evolved = []
+        self.proceed = threading.Event()
+        self.proceed.set()
+        self.addCleanup(generations._background.clear)
+
+        @interface.implementer(ISchemaManager)
+        class Manager:
+            generation = 0
+            minimum_generation = 0
+
+            def evolve(self, context, generation):
+                test.proceed.wait(10)
+                if generation == test.fail_at:
+                    raise ValueError(generation)
+                context.connection.root()['app'] = generation
+                test.evolved.append(generation)
+
+        self.manager = Manager()
+        component.provideUtility(self.manager, ISchemaManager, name='app')
+        evolve(self.db)
+        self.manager.generation = 3
+
+    def _generation(self):
+        import transaction
+
+        from zope.generations.generations import generations_key
+        conn = self.db.open()
+        try:
+            with transaction.manager:
+                return conn.root()[generations_key]['app']
+        finally:
+            conn.close()
+
+    def _progress(self):
+        import transaction
+
+        from zope.generations.generations import progress_key
+        conn = self.db.open()
+        try:
+            with transaction.manager:
+                return conn.root()[progress_key].get('app')
+        finally:
+            conn.close()
+
+    def _start(self, **kw):
+        from zope.generations.generations import evolveInBackground
+        evolution = evolveInBackground(self.db, **kw)
+        self.addCleanup(evolution.cancel)
+        return evolution
+
+    def test_finished(self):
+        from zope.generations.generations import getBackgroundEvolution
+
+        self.assertIsNone(getBackgroundEvolution(self.db))
+        evolution = self._start(delay=0.01)
+        self.assertIs(getBackgroundEvolution(self.db), evolution)
+        evolution.join(10)
+        self.assertEqual(evolution.state, 'finished')
+        self.assertEqual(evolution.step, ('app', 3))
+        self.assertEqual(evolution.steps, 3)
+        self.assertIsNone(evolution.error)
+        self.assertEqual(self._generation(), 3)
+
+    def test_cancel(self):
+        self.proceed.clear()
+        evolution = self._start(delay=60)
+        while evolution.step is None:
+            evolution.join(0.01)
+        self.assertEqual(evolution.state, 'running')
+        # The step being done is finished, the others are not started.
+        self.proceed.set()
+        evolution.cancel(10)
+        self.assertEqual(evolution.state, 'cancelled')
+        self.assertEqual(self.evolved, [1])
+        self.assertEqual(self._generation(), 1)
+
+    def test_cancel_reporting_step(self):
+        import threading
+
+        started = threading.Event()
+
+        def evolve(context, generation):
+            context.checkpoint('started')
+            started.set()
+            # A step that would go on for a long time.
+            for done in range(10 ** 9):
+                context.progress(done)
+
+        self.manager.evolve = evolve
+        evolution = self._start()
+        self.assertTrue(started.wait(10))
+        evolution.cancel(10)
+        self.assertEqual(evolution.state, 'cancelled')
+        self.assertEqual(self._generation(), 0)
+        # The work checkpointed is kept for the next time.
+        self.assertEqual(self._progress(), (1, 'started'))
+
+    def test_cancel_reporting_step_in_parallel(self):
+        import threading
+
+        from zope import interface
+        from zope.generations.generations import prepareParallelEvolution
+        from zope.generations.interfaces import IDependentSchemaManager
+
+        started = threading.Event()
+
+        def evolve(context, generation):
+            started.set()
+            for done in range(10 ** 9):
+                context.progress(done)
+
+        self.manager.evolve = evolve
+        interface.alsoProvides(self.manager, IDependentSchemaManager)
+        self.manager.depends_on = ()
+        prepareParallelEvolution(self.db)
+        evolution = self._start(workers=2)
+        self.assertTrue(started.wait(10))
+        evolution.cancel(10)
+        self.assertEqual(evolution.state, 'cancelled')
+
+    def test_cancel_on_exit_is_bounded(self):
+        from unittest import mock
+
+        from zope.generations import generations
+
+        with mock.patch.object(generations.atexit, 'register') as register:
+            evolution = self._start()
+        evolution.join(10)
+        register.assert_called_once_with(
+            evolution.cancel, evolution.shutdown_timeout)
+
+    def test_cancel_squashed(self):
+        evolution = self._start(delay=60, squash=True)
+        while self.evolved != [1]:
+            evolution.join(0.01)
+        evolution.cancel(10)
+        self.assertEqual(evolution.state, 'cancelled')
+        self.assertEqual(self._generation(), 1)
+
+    def test_failed(self):
+        from zope.generations.interfaces import UnableToEvolve
+
+        self.manager.minimum_generation = 2
+        self.fail_at = 2
+        evolution = self._start()
+        evolution.join(10)
+        self.assertEqual(evolution.state, 'failed')
+        self.assertIsInstance(evolution.error, UnableToEvolve)
+        self.assertEqual(self._generation(), 1)
+
+    def test_subscriber(self):
+        import os
+
+        from zope.processlifetime import DatabaseOpenedWithRoot
+
+        from zope.generations.generations import evolveInBackgroundSubscriber
+        from zope.generations.generations import getBackgroundEvolution
+        from zope.generations.generations import step_delay_variable
+
+        self.manager.minimum_generation = 1
+        os.environ[step_delay_variable] = '0.5'
+        self.addCleanup(os.environ.pop, step_delay_variable)
+        evolveInBackgroundSubscriber(DatabaseOpenedWithRoot(self.db))
+        # The minimum generation was reached before returning.
+        self.assertEqual(self.evolved[0], 1)
+        evolution = getBackgroundEvolution(self.db)
+        self.addCleanup(evolution.cancel)
+        self.assertEqual(evolution.delay, 0.5)
+        evolution.join(10)
+        self.assertEqual(evolution.state, 'finished')
+        self.assertEqual(self._generation(), 3)
+
+
+class TestLease(cleanup.CleanUp,
+                unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        import threading
+
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope import interface
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import ISchemaManager
+
+        test = self
+        self.db = DB()
+        self.addCleanup(self.db.close)
+        self.evolved = []
+        self.started = threading.Event()
+        self.proceed = threading.Event()
+        self.proceed.set()
+
+        @interface.implementer(ISchemaManager)
+        class Manager:
+            generation = 0
+            minimum_generation = 0
+
+            def evolve(self, context, generation):
+                test.evolved.append(generation)
+                test.started.set()
+                test.proceed.wait(10)
+
+        self.manager = Manager()
+        component.provideUtility(self.manager, ISchemaManager, name='app')
+        evolve(self.db)
+        self.manager.generation = 1
+
+    def _lease(self):
+        import transaction
+
+        from zope.generations.generations import lease_key
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        try:
+            with tm:
+                lease = conn.root()[lease_key]
+                return lease.owner, lease.expires
+        finally:
+            conn.close()
+
+    def _setLease(self, owner, expires):
+        import transaction
+
+        from zope.generations.generations import EvolutionLease
+        from zope.generations.generations import lease_key
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        with tm:
+            lease = conn.root()[lease_key] = EvolutionLease()
+            lease.owner = owner
+            lease.expires = expires
+        conn.close()
+
+    def _evolveInThread(self, **kw):
+        import threading
+
+        from zope.generations.generations import evolve
+        thread = threading.Thread(target=evolve, args=(self.db,), kwargs=kw)
+        thread.start()
+        self.addCleanup(thread.join, 10)
+        return thread
+
+    def test_one_process_evolves(self):
+        import time
+
+        self.proceed.clear()
+        first = self._evolveInThread(lease_duration=1, lease_owner='first')
+        self.started.wait(10)
+        self.assertEqual(self._lease()[0], 'first')
+        second = self._evolveInThread(lease_duration=1, lease_owner='second')
+        time.sleep(0.3)
+        self.assertTrue(second.is_alive())
+        self.proceed.set()
+        first.join(10)
+        second.join(10)
+        self.assertEqual(self.evolved, [1])
+        self.assertEqual(self._lease(), (None, 0))
+
+    def test_renewed(self):
+        import time
+
+        self.proceed.clear()
+        self._evolveInThread(lease_duration=0.3, lease_owner='first')
+        self.started.wait(10)
+        time.sleep(0.5)
+        owner, expires = self._lease()
+        self.assertEqual(owner, 'first')
+        self.assertGreater(expires, time.time())
+        self.proceed.set()
+
+    def test_expired_lease_taken_over(self):
+        import time
+
+        from zope.generations.generations import evolve
+
+        self._setLease('dead', time.time() + 0.5)
+        evolve(self.db, lease_duration=1, lease_owner='alive')
+        self.assertEqual(self.evolved, [1])
+        self.assertEqual(self._lease(), (None, 0))
+
+    def test_environment(self):
+        import os
+        import time
+
+        from zope.generations.generations import lease_duration_variable
+
+        os.environ[lease_duration_variable] = '2'
+        self.addCleanup(os.environ.pop, lease_duration_variable)
+        self._setLease('other', time.time() + 60)
+        self.proceed.clear()
+        thread = self._evolveInThread()
+        time.sleep(0.2)
+        self.assertEqual(self.evolved, [])
+        self.assertTrue(thread.is_alive())
+        # Releasing the lease lets it continue.
+        self._setLease(None, 0)
+        self.proceed.set()
+        thread.join(30)
+        self.assertEqual(self.evolved, [1])
+
+
+class TestRetry(cleanup.CleanUp,
+                unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        from unittest import mock
+
+        import zope.event
+        from persistent.mapping import PersistentMapping
+        from ZODB.MappingStorage import DB
+        from ZODB.POSException import ConflictError
+
+        from zope import component
+        from zope import interface
+        from zope.generations import generations
+        from zope.generations.interfaces import IInstallableSchemaManager
+        from zope.generations.interfaces import ISchemaManager
+
+        test = self
+        self.db = DB()
+        self.addCleanup(self.db.close)
+        self.events = []
+        zope.event.subscribers.append(self.events.append)
+        self.addCleanup(zope.event.subscribers.remove, self.events.append)
+        self.conflicts = {}
+        self.calls = []
+        self.sleeps = []
+        patcher = mock.patch.object(generations, '_sleep', self.sleeps.append)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        def conflict(generation):
+            test.calls.append(generation)
+            if test.conflicts.get(generation):
+                test.conflicts[generation] -= 1
+                raise ConflictError()
+
+        @interface.implementer(IInstallableSchemaManager)
+        class Manager:
+            generation = 3
+            minimum_generation = 3
+
+            def install(self, context):
+                conflict(None)
+                context.connection.root()['data'] = PersistentMapping()
+
+            def evolve(self, context, generation):
+                conflict(generation)
+                context.connection.root()['data'][generation] = True
+
+        self.manager = Manager()
+        component.provideUtility(self.manager, ISchemaManager, name='app')
+
+    def _root(self):
+        conn = self.db.open()
+        try:
+            root = conn.root()
+            return (dict(root['zope.generations']),
+                    sorted(root.get('data', {})))
+        finally:
+            conn.close()
+
+    def _retries(self, event):
+        return [(e.generation, e.retries, e.error is not None)
+                for e in self.events if isinstance(e, event)]
+
+    def _setUpGeneration(self, generation):
+        import transaction
+        from persistent.mapping import PersistentMapping
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        root = conn.root()
+        root['zope.generations'] = PersistentMapping(app=generation)
+        root['data'] = PersistentMapping()
+        tm.commit()
+        conn.close()
+
+    def test_install(self):
+        from zope.generations.events import InstallFinished
+        from zope.generations.generations import evolve
+
+        self.conflicts[None] = 1
+        evolve(self.db, retries=1)
+        self.assertEqual(self._root(), ({'app': 3}, []))
+        self.assertEqual(self._retries(InstallFinished),
+                         [(3, 0, True), (3, 1, False)])
+        self.assertEqual(len(self.sleeps), 1)
+
+    def test_steps(self):
+        from zope.generations.events import EvolutionStepFinished
+        from zope.generations.generations import evolve
+
+        self._setUpGeneration(0)
+        self.conflicts[2] = 2
+        evolve(self.db, retries=2)
+        self.assertEqual(self._root(), ({'app': 3}, [1, 2, 3]))
+        self.assertEqual(self.calls, [1, 2, 2, 2, 3])
+        self.assertEqual(self._retries(EvolutionStepFinished), [
+            (1, 0, False),
+            (2, 0, True),
+            (2, 1, True),
+            (2, 2, False),
+            (3, 0, False),
+        ])
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertTrue(0 <= self.sleeps[0] <= 0.1)
+        self.assertTrue(0 <= self.sleeps[1] <= 0.2)
+
+    def test_retries_exhausted(self):
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import UnableToEvolve
+
+        self._setUpGeneration(0)
+        self.conflicts[2] = 2
+        with self.assertRaises(UnableToEvolve):
+            evolve(self.db, retries=1)
+        self.assertEqual(self._root(), ({'app': 1}, [1]))
+        self.assertEqual(self.calls, [1, 2, 2])
+
+    def test_no_retries_by_default(self):
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import UnableToEvolve
+
+        self._setUpGeneration(0)
+        self.conflicts[2] = 1
+        with self.assertRaises(UnableToEvolve):
+            evolve(self.db)
+        self.assertEqual(self.calls, [1, 2])
+        self.assertEqual(self.sleeps, [])
+
+    def test_other_errors_not_retried(self):
+        from zope.generations.generations import evolve
+        from zope.generations.interfaces import UnableToEvolve
+
+        self._setUpGeneration(0)
+        self.manager.evolve = lambda context, generation: (
+            self.calls.append(generation), 1 / 0)
+        with self.assertRaises(UnableToEvolve):
+            evolve(self.db, retries=3)
+        self.assertEqual(self.calls, [1])
+        self.assertEqual(self.sleeps, [])
+
+    def test_squash_starts_over(self):
+        from zope.generations.generations import evolve
+
+        self._setUpGeneration(0)
+        self.conflicts[3] = 1
+        evolve(self.db, retries=1, squash=True)
+        self.assertEqual(self._root(), ({'app': 3}, [1, 2, 3]))
+        self.assertEqual(self.calls, [1, 2, 3, 1, 2, 3])
+
+
+class TestProgress(cleanup.CleanUp,
+                   unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        import zope.event
+        from persistent.mapping import PersistentMapping
+        from ZODB.MappingStorage import DB
+
+        from zope import component
+        from zope import interface
+        from zope.generations import generations
+        from zope.generations.interfaces import ISchemaManager
+        from zope.generations.utility import findObjectsMatching
+
+        self.db = DB(database_name='testdb')
+        self.addCleanup(self.db.close)
+        self.events = []
+        zope.event.subscribers.append(self.events.append)
+        self.addCleanup(zope.event.subscribers.remove, self.events.append)
+        self.addCleanup(setattr, generations._Step, 'progress_interval',
+                        generations._Step.progress_interval)
+        generations._Step.progress_interval = 0
+
+        @interface.implementer(ISchemaManager)
+        class Manager:
+            generation = 0
+            minimum_generation = 0
+
+            def evolve(self, context, generation):
+                root = context.connection.root()
+                if generation == 1:
+                    for i in context.track(range(3)):
+                        root[i] = PersistentMapping()
+                elif generation == 2:
+                    context.progress(10)
+                    context.progress(20)
+                else:
+                    workers = 1 if generation == 3 else 2
+                    for obj in findObjectsMatching(
+                            root, lambda obj: True, workers=workers,
+                            total=4):
+                        pass
+
+        self.manager = Manager()
+        component.provideUtility(self.manager, ISchemaManager, name='app')
+
+    def _progress(self):
+        from zope.generations.events import EvolutionStepProgress
+        return [(e.generation, e.done, e.total, e.eta is not None)
+                for e in self.events if isinstance(e, EvolutionStepProgress)]
+
+    def test_track(self):
+        from zope.testing import loggingsupport
+
+        from zope.generations.generations import evolve
+
+        evolve(self.db)
+        self.manager.generation = 1
+        log = loggingsupport.InstalledHandler('zope.generations')
+        self.addCleanup(log.uninstall)
+        evolve(self.db)
+        self.assertEqual(self._progress(), [
+            (1, 1, 3, True),
+            (1, 2, 3, True),
+            (1, 3, 3, True),
+        ])
+        messages = [r.getMessage() for r in log.records
+                    if 'done' in r.getMessage()]
+        self.assertEqual(len(messages), 3)
+        self.assertTrue(messages[0].startswith(
+            'testdb/app: generation 1: 1 of 3 done ('), messages[0])
+        self.assertTrue(messages[2].endswith(', about 0s left)'),
+                        messages[2])
+
+    def test_without_total(self):
+        from zope.generations.generations import evolve
+
+        evolve(self.db)
+        self.manager.generation = 2
+        evolve(self.db)
+        self.assertEqual(self._progress(), [
+            (1, 1, 3, True),
+            (1, 2, 3, True),
+            (1, 3, 3, True),
+            (2, 10, None, False),
+            (2, 20, None, False),
+        ])
+
+    def test_throttled(self):
+        from zope.generations import generations
+
+        generations.evolve(self.db)
+        generations._Step.progress_interval = 3600
+        self.manager.generation = 2
+        generations.evolve(self.db)
+        # Only reaching the total is reported right away.
+        self.assertEqual(self._progress(), [(1, 3, 3, True)])
+
+    def test_utility(self):
+        from zope.generations.generations import evolve
+
+        evolve(self.db)
+        self.manager.generation = 3
+        evolve(self.db)
+        # Every object visited is reported, the estimate being too low.
+        visited = [(done, total) for generation, done, total, _
+                   in self._progress() if generation == 3]
+        self.assertEqual(visited, [(i, 4) for i in range(1, 7)])
+
+    def test_utility_in_parallel(self):
+        from zope.generations.generations import evolve
+
+        evolve(self.db)
+        self.manager.generation = 4
+        evolve(self.db)
+        # Reported as the objects are found.
+        visited = [done for generation, done, total, _
+                   in self._progress() if generation == 4]
+        self.assertEqual(len(visited), 6)
+        self.assertEqual(visited[-1], 6)
+
+    def test_outside_evolve(self):
+        from zope.generations.generations import Context
+
+        self.assertEqual(list(Context().track([1, 2])), [1, 2])
+        Context().progress(1, 2)
+        self.assertEqual(self.events, [])
+
 
 class TestEvolveExplicit(TestEvolve):
 
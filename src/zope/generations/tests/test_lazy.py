@@ -0,0 +1,232 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Tests for evolving objects lazily."""
+import unittest
+
+import transaction
+from persistent import Persistent
+from zope.testing import cleanup
+
+from zope import component
+from zope import interface
+from zope.generations.generations import evolve
+from zope.generations.generations import generations_key
+from zope.generations.interfaces import IBatchSchemaManager
+from zope.generations.interfaces import ILazySchemaManager
+from zope.generations.interfaces import ISchemaManager
+from zope.generations.lazy import LazilyEvolved
+from zope.generations.lazy import sweep
+
+
+class Document(LazilyEvolved, Persistent):
+
+    _generations_key = 'app'
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Other(LazilyEvolved, Persistent):
+
+    _generations_key = 'other'
+
+
+@interface.implementer(ILazySchemaManager)
+class Manager:
+
+    minimum_generation = 0
+
+    def __init__(self):
+        self.generation = 0
+        self.transforms = {
+            1: self.addTitle,
+            2: self.upperTitle,
+            4: self.addVersion,
+        }
+        self.applied = []
+        self.evolved = []
+
+    def addTitle(self, obj):
+        self.applied.append((1, obj.name))
+        obj.title = obj.name
+
+    def upperTitle(self, obj):
+        self.applied.append((2, obj.name))
+        obj.title = obj.title.upper()
+
+    def addVersion(self, obj):
+        self.applied.append((4, obj.name))
+        obj.version = 4
+
+    def evolve(self, context, generation):
+        self.evolved.append(generation)
+
+    def getTransform(self, generation):
+        return self.transforms.get(generation)
+
+
+@interface.implementer_only(IBatchSchemaManager)
+class BatchManager(Manager):
+    pass
+
+
+class TestLazy(cleanup.CleanUp, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        from ZODB.MappingStorage import DB
+
+        self.db = DB()
+        self.addCleanup(self.db.close)
+        self.manager = Manager()
+        component.provideUtility(self.manager, ISchemaManager, name='app')
+        evolve(self.db)
+        root = self._open()
+        for name in 'abc':
+            root[name] = Document(name)
+        root['other'] = Other()
+        root._p_jar.transaction_manager.commit()
+
+    def _open(self):
+        tm = transaction.TransactionManager()
+        conn = self.db.open(tm)
+        self.addCleanup(conn.close)
+        self.addCleanup(tm.abort)
+        conn.cacheMinimize()
+        tm.begin()
+        return conn.root()
+
+    def _stored(self):
+        return self._open()[generations_key]['app']
+
+    def test_new_objects_stamped(self):
+        doc = self._open()['a']
+        self.assertEqual(doc.name, 'a')
+        self.assertEqual(doc.__dict__['_generations_stamp'], 0)
+
+    def test_evolve_leaves_transforms(self):
+        self.manager.generation = 3
+        evolve(self.db)
+        self.assertEqual(self.manager.evolved, [])
+        self.assertEqual(self._stored(), 0)
+
+    def test_evolved_when_loaded(self):
+        self.manager.generation = 2
+        evolve(self.db)
+        tid = self.db.lastTransaction()
+        root = self._open()
+        doc = root['a']
+        self.assertEqual(doc.title, 'A')
+        self.assertEqual(self.manager.applied, [(1, 'a'), (2, 'a')])
+        self.assertFalse(doc._p_changed)
+        doc._p_jar.transaction_manager.commit()
+        self.assertEqual(self.db.lastTransaction(), tid)
+
+        # Changing the object writes the evolved state.
+        doc = self._open()['b']
+        doc.name = 'b'
+        doc._p_jar.transaction_manager.commit()
+        del self.manager.applied[:]
+        root = self._open()
+        self.assertEqual(root['b'].title, 'B')
+        self.assertEqual(root['c'].title, 'C')
+        self.assertEqual(self.manager.applied, [(1, 'c'), (2, 'c')])
+
+    def test_sweep(self):
+        self.manager.generation = 3
+        evolve(self.db)
+        self.assertTrue(sweep(self.db, 'app', batch_size=2))
+        self.assertEqual(self._stored(), 2)
+        del self.manager.applied[:]
+        root = self._open()
+        self.assertEqual([root[name].title for name in 'abc'],
+                         ['A', 'B', 'C'])
+        self.assertEqual(self.manager.applied, [])
+        # Now the full evolution step can be done.
+        evolve(self.db)
+        self.assertEqual(self.manager.evolved, [3])
+        self.assertEqual(self._stored(), 3)
+        # A sweep with nothing to do is complete right away.
+        self.assertTrue(sweep(self.db, 'app'))
+
+    def test_stamp_below_stored_generation(self):
+        self.manager.generation = 3
+        evolve(self.db)
+        sweep(self.db, 'app')
+        evolve(self.db)
+        # The objects are stamped with generation 2, but were evolved to
+        # 3 by the full evolution step.
+        self.manager.generation = 4
+        evolve(self.db)
+        del self.manager.applied[:]
+        self.assertEqual(self._open()['a'].version, 4)
+        self.assertEqual(self.manager.applied, [(4, 'a')])
+        self.assertTrue(sweep(self.db, 'app'))
+        self.assertEqual(self._stored(), 4)
+
+    def test_not_lazy(self):
+        manager = BatchManager()
+        manager.generation = 2
+        component.provideUtility(manager, ISchemaManager, name='app')
+        doc = self._open()['a']
+        self.assertEqual(doc.name, 'a')
+        self.assertNotIn('title', doc.__dict__)
+        self.assertTrue(sweep(self.db, 'app'))
+        self.assertEqual(self._stored(), 0)
+
+    def test_minimum_after_lazy_generations(self):
+        from zope.generations.generations import EVOLVEMINIMUM
+        from zope.generations.interfaces import UnableToEvolve
+
+        self.manager.transforms = {1: self.manager.addTitle}
+        self.manager.generation = self.manager.minimum_generation = 2
+        # Generation 2 can't be reached before the objects were swept.
+        with self.assertRaises(UnableToEvolve):
+            evolve(self.db, EVOLVEMINIMUM)
+        self.assertEqual(self.manager.evolved, [])
+        self.assertEqual(self._stored(), 0)
+
+        self.assertTrue(sweep(self.db, 'app'))
+        evolve(self.db, EVOLVEMINIMUM)
+        self.assertEqual(self.manager.evolved, [2])
+        self.assertEqual(self._stored(), 2)
+
+    def test_swept_in_background(self):
+        from zope.generations.generations import evolveInBackground
+
+        self.manager.generation = 4
+        evolution = evolveInBackground(self.db)
+        evolution.join(10)
+        self.assertEqual(evolution.state, 'finished')
+        # Generations 1 and 2 were swept before step 3 was done, then
+        # generation 4 was swept.
+        self.assertEqual(self.manager.evolved, [3])
+        self.assertEqual(self._stored(), 4)
+        del self.manager.applied[:]
+        root = self._open()
+        self.assertEqual([(root[name].title, root[name].version)
+                          for name in 'abc'],
+                         [('A', 4), ('B', 4), ('C', 4)])
+        self.assertEqual(self.manager.applied, [])
+
+    def test_sweep_cancelled(self):
+        from zope.generations.generations import BackgroundEvolution
+
+        self.manager.generation = 3
+        evolution = BackgroundEvolution(self.db)
+        evolution.cancel()
+        evolution.start()
+        evolution.join(10)
+        self.assertEqual(evolution.state, 'cancelled')
+        self.assertEqual(self._stored(), 0)
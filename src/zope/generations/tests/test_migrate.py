@@ -0,0 +1,241 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Tests for evolving databases while copying them."""
+import types
+import unittest
+
+import transaction
+from persistent import Persistent
+from persistent.mapping import PersistentMapping
+from zope.testing import cleanup
+
+from zope import component
+from zope import interface
+from zope.generations.generations import SchemaManager
+from zope.generations.generations import evolve
+from zope.generations.generations import generations_key
+from zope.generations.interfaces import ISchemaManager
+from zope.generations.interfaces import IStateSchemaManager
+from zope.generations.migrate import migrate
+
+
+class Document(Persistent):
+
+    def __init__(self, title):
+        self.title = title
+
+
+def rename(state):
+    state['name'] = state.pop('title')
+    return state
+
+
+def link(state):
+    # The persistent objects are stand-ins, but can be stored anywhere.
+    state['container'] = state['parent']
+    return state
+
+
+@interface.implementer(IStateSchemaManager)
+class Manager:
+
+    generation = 0
+    minimum_generation = 0
+
+    def __init__(self):
+        self.evolved = []
+
+    def getStateTransforms(self, generation):
+        if generation == 1:
+            return {__name__ + '.Document': rename}
+        if generation == 2:
+            return {__name__ + '.Document': link}
+        return None
+
+    def getInfo(self, generation):
+        return None
+
+    def evolve(self, context, generation):
+        self.evolved.append(generation)
+        root = context.connection.root()
+        root['new'] = PersistentMapping(generation=generation)
+
+
+class TestMigrate(cleanup.CleanUp,
+                  unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        from ZODB.MappingStorage import DB
+
+        self.source = DB(database_name='source')
+        self.addCleanup(self.source.close)
+        self.destination = DB(database_name='destination')
+        self.addCleanup(self.destination.close)
+        self.manager = Manager()
+        component.provideUtility(self.manager, ISchemaManager, name='app')
+
+        evolve(self.source)
+        with self.source.transaction() as conn:
+            root = conn.root()
+            root['docs'] = docs = PersistentMapping()
+            for i in range(5):
+                docs[i] = Document('doc %d' % i)
+                docs[i].parent = docs
+            docs['self'] = docs
+
+    def test_migrate(self):
+        self.manager.generation = 3
+        migrate(self.source, self.destination, records=4, batch_size=2)
+
+        with self.destination.transaction() as conn:
+            root = conn.root()
+            docs = root['docs']
+            self.assertEqual(
+                [(doc.name, doc.container is docs) for i, doc in sorted(
+                    (i, doc) for i, doc in docs.items() if i != 'self')],
+                [('doc %d' % i, True) for i in range(5)])
+            self.assertFalse(hasattr(docs[0], 'title'))
+            self.assertEqual(dict(root[generations_key]), {'app': 3})
+            # The object added by the last step got an oid of its own.
+            self.assertEqual(dict(root['new']), {'generation': 3})
+            self.assertNotIn(root['new']._p_oid,
+                             [doc._p_oid for doc in docs.values()])
+        self.assertEqual(self.manager.evolved, [3])
+
+        # The source wasn't changed.
+        with self.source.transaction() as conn:
+            root = conn.root()
+            self.assertEqual(root['docs'][0].title, 'doc 0')
+            self.assertEqual(dict(root[generations_key]), {'app': 0})
+
+        # 8 records, the root, the generations data, the mapping and the
+        # documents, were copied in two transactions.
+        descriptions = [t.description
+                        for t in self.destination.storage.iterator()]
+        self.assertEqual(descriptions.count(b'Copying from source'), 2)
+
+    def test_up_to_date(self):
+        migrate(self.source, self.destination)
+        with self.destination.transaction() as conn:
+            self.assertEqual(conn.root()['docs'][0].title, 'doc 0')
+            self.assertEqual(dict(conn.root()[generations_key]), {'app': 0})
+        self.assertEqual(self.manager.evolved, [])
+
+    def test_destination_not_empty(self):
+        with self.destination.transaction() as conn:
+            conn.root()['x'] = PersistentMapping()
+        with self.assertRaises(ValueError):
+            migrate(self.source, self.destination)
+
+
+class TestBlobs(cleanup.CleanUp,
+                unittest.TestCase):
+
+    def _makeDB(self, name, blobs=True):
+        import shutil
+        import tempfile
+
+        from ZODB.blob import BlobStorage
+        from ZODB.DB import DB
+        from ZODB.MappingStorage import MappingStorage
+
+        storage = MappingStorage()
+        if blobs:
+            directory = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, directory)
+            storage = BlobStorage(directory, storage)
+        db = DB(storage, database_name=name)
+        self.addCleanup(db.close)
+        return db
+
+    def setUp(self):
+        from ZODB.blob import Blob
+
+        super().setUp()
+        self.source = self._makeDB('source')
+        with self.source.transaction() as conn:
+            conn.root()['blob'] = blob = Blob()
+            with blob.open('w') as f:
+                f.write(b'data')
+
+    def test_blobs(self):
+        destination = self._makeDB('destination')
+        migrate(self.source, destination)
+        with destination.transaction() as conn:
+            with conn.root()['blob'].open() as f:
+                self.assertEqual(f.read(), b'data')
+        # The source kept its file.
+        with self.source.transaction() as conn:
+            with conn.root()['blob'].open() as f:
+                self.assertEqual(f.read(), b'data')
+
+    def test_destination_without_blobs(self):
+        with self.assertRaises(ValueError):
+            migrate(self.source, self._makeDB('destination', blobs=False))
+
+
+class TestSchemaManager(cleanup.CleanUp,
+                        unittest.TestCase):
+
+    def test_state_transforms(self):
+        from ZODB.MappingStorage import DB
+
+        db = DB()
+        self.addCleanup(db.close)
+        manager = SchemaManager()
+        component.provideUtility(manager, ISchemaManager, name='app')
+        evolve(db)
+        tm = transaction.TransactionManager()
+        conn = db.open(tm)
+        self.addCleanup(conn.close)
+        with tm:
+            conn.root()['doc'] = Document('doc')
+
+        evolver = types.ModuleType('evolve1', 'Rename the titles.')
+        evolver.state_transforms = {__name__ + '.Document': rename}
+        manager._evolvers[1] = evolver
+        manager.generation = 1
+        self.assertEqual(manager.getStateTransforms(1),
+                         evolver.state_transforms)
+        self.assertEqual(manager.getInfo(1), 'Rename the titles.')
+        evolve(db)
+        with tm:
+            self.assertEqual(conn.root()['doc'].name, 'doc')
+
+    def test_state_transforms_squashed(self):
+        from ZODB.MappingStorage import DB
+
+        db = DB()
+        self.addCleanup(db.close)
+        manager = SchemaManager()
+        component.provideUtility(manager, ISchemaManager, name='app')
+        evolve(db)
+
+        def addDocument(context):
+            context.connection.root()['doc'] = Document('doc')
+
+        manager._evolvers[1] = types.ModuleType('evolve1')
+        manager._evolvers[1].evolve = addDocument
+        manager._evolvers[2] = types.ModuleType('evolve2')
+        manager._evolvers[2].state_transforms = {
+            __name__ + '.Document': rename}
+        manager.generation = 2
+        evolve(db, squash=True)
+        # The document added by the step before was transformed, too.
+        with db.transaction() as conn:
+            doc = conn.root()['doc']
+            self.assertEqual(doc.name, 'doc')
+            self.assertFalse(hasattr(doc, 'title'))
+            self.assertEqual(dict(conn.root()[generations_key]), {'app': 2})
@@ -0,0 +1,213 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Tests for the ``zope-generations`` command."""
+import contextlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import transaction
+from zope.testing import cleanup
+
+from zope import interface
+from zope.generations.generations import generations_key
+from zope.generations.interfaces import IInstallableSchemaManager
+from zope.generations.script import main
+
+
+@interface.implementer(IInstallableSchemaManager)
+class Manager:
+
+    generation = 2
+    minimum_generation = 1
+
+    def install(self, context):
+        context.connection.root()['app'] = 'installed'
+
+    def evolve(self, context, generation):
+        context.connection.root()['app'] = generation
+
+    def getInfo(self, generation):
+        return 'Evolve to %d.\n\nMore details.' % generation
+
+
+manager = Manager()
+
+zcml = """\
+<configure xmlns="http://namespaces.zope.org/zope">
+  <include package="zope.component" file="meta.zcml" />
+  <utility
+      name="app"
+      provides="zope.generations.interfaces.ISchemaManager"
+      component="zope.generations.tests.test_script.manager"
+      />
+</configure>
+"""
+
+
+class TestScript(cleanup.CleanUp,
+                 unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = os.path.join(self.tmp, 'Data.fs')
+        self.zcml = os.path.join(self.tmp, 'generations.zcml')
+        with open(self.zcml, 'w') as f:
+            f.write(zcml)
+        manager.generation = 2
+        manager.minimum_generation = 1
+        handlers = logging.root.handlers[:]
+        self.addCleanup(setattr, logging.root, 'handlers', handlers)
+
+    def _run(self, *args):
+        out = io.StringIO()
+        err = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            status = main(['--file', self.path, '--zcml', self.zcml]
+                          + list(args))
+        return status, out.getvalue(), err.getvalue()
+
+    def _setUpGeneration(self, generation):
+        from persistent.mapping import PersistentMapping
+        from ZODB import DB
+        from ZODB.FileStorage import FileStorage
+        db = DB(FileStorage(self.path))
+        tm = transaction.TransactionManager()
+        conn = db.open(tm)
+        conn.root()[generations_key] = PersistentMapping(app=generation)
+        tm.commit()
+        db.close()
+
+    def _root(self):
+        from ZODB import DB
+        from ZODB.FileStorage import FileStorage
+        db = DB(FileStorage(self.path, read_only=True))
+        tm = transaction.TransactionManager()
+        conn = db.open(tm)
+        try:
+            root = conn.root()
+            return root['app'], dict(root[generations_key])
+        finally:
+            tm.abort()
+            db.close()
+
+    def _generationsClass(self):
+        from ZODB import DB
+        from ZODB.FileStorage import FileStorage
+        db = DB(FileStorage(self.path, read_only=True))
+        try:
+            with db.transaction() as conn:
+                return type(conn.root()[generations_key]).__name__
+        finally:
+            db.close()
+
+    def test_status(self):
+        self._setUpGeneration(0)
+        self.assertEqual(self._run('status'), (
+            0, 'app: at 0 (minimum 1, current 2), below minimum\n', ''))
+
+    def test_plan(self):
+        self._setUpGeneration(0)
+        self.assertEqual(self._run('plan')[:2], (0, (
+            'app: generation 0 to 2\n'
+            '  1 (required): Evolve to 1.\n'
+            '  2: Evolve to 2.\n')))
+        self.assertEqual(self._run('plan', '--mode', 'minimum')[:2], (0, (
+            'app: generation 0 to 1\n'
+            '  1 (required): Evolve to 1.\n')))
+
+    def test_plan_not(self):
+        self._setUpGeneration(0)
+        status, out, err = self._run('plan', '--mode', 'not')
+        self.assertEqual(status, 1)
+        self.assertEqual(err, "GenerationTooLow: (0, 'app', 1)\n")
+
+    def test_evolve(self):
+        self._setUpGeneration(0)
+        status, out, err = self._run('evolve', '--progress')
+        self.assertEqual((status, out), (0, ''))
+        lines = err.splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith(
+            '[1/2] app: evolved to generation 1 in '), lines[0])
+        self.assertTrue(lines[1].startswith(
+            '[2/2] app: evolved to generation 2 in '), lines[1])
+        self.assertTrue(lines[1].endswith('about 0:00:00 left'), lines[1])
+        self.assertEqual(self._root(), (2, {'app': 2}))
+        self.assertEqual(self._run('status')[1],
+                         'app: at 2 (minimum 1, current 2), up to date\n')
+
+    def test_install(self):
+        self.assertEqual(self._run('prepare-parallel'), (0, '', ''))
+        status, out, err = self._run(
+            'evolve', '--progress', '--workers', '2', '--batch-size', '10')
+        self.assertEqual(status, 0)
+        self.assertTrue(err.startswith(
+            '[1/1] app: installed generation 2 in '), err)
+        self.assertEqual(self._root(), ('installed', {'app': 2}))
+        self.assertEqual(self._generationsClass(), 'GenerationsMapping')
+
+    def test_evolve_minimum(self):
+        self._setUpGeneration(0)
+        self.assertEqual(self._run('evolve', '--mode', 'minimum'),
+                         (0, '', ''))
+        self.assertEqual(self._root(), (1, {'app': 1}))
+
+    def test_migrate(self):
+        from ZODB import DB
+        from ZODB.FileStorage import FileStorage
+
+        self._setUpGeneration(0)
+        destination = os.path.join(self.tmp, 'Evolved.fs')
+        self.assertEqual(self._run('migrate', destination, '--records', '2',
+                                   '--workers', '2', '--batch-size', '10'),
+                         (0, '', ''))
+        db = DB(FileStorage(destination, read_only=True))
+        try:
+            with db.transaction() as conn:
+                root = conn.root()
+                self.assertEqual(root['app'], 2)
+                self.assertEqual(dict(root[generations_key]), {'app': 2})
+        finally:
+            db.close()
+        # The source wasn't changed.
+        self.assertEqual(self._run('status')[1],
+                         'app: at 0 (minimum 1, current 2), below minimum\n')
+
+        with self.assertRaises(SystemExit):
+            self._run('migrate', destination)
+
+    def test_options(self):
+        from zope.generations.script import _parser
+        parser = _parser()
+        args = ['--file', self.path]
+        options = parser.parse_args(args + ['migrate', 'Evolved.fs',
+                                            '--workers', '3'])
+        self.assertEqual((options.workers, options.batch_size), (3, None))
+        options = parser.parse_args(args + ['evolve', '--batch-size', '5'])
+        self.assertEqual((options.workers, options.batch_size), (1, 5))
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                parser.parse_args(args + ['plan', '--workers', '3'])
+
+    def test_evolve_too_high(self):
+        self._setUpGeneration(3)
+        status, out, err = self._run('evolve')
+        self.assertEqual(status, 1)
+        self.assertEqual(err, "GenerationTooHigh: (3, 'app', 2)\n")
@@ -0,0 +1,428 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Tests for the utility functions working on a database."""
+import io
+import unittest
+
+import transaction
+from persistent.mapping import PersistentMapping
+
+from zope import interface
+
+
+class IMarker(interface.Interface):
+    pass
+
+
+class Container(PersistentMapping):
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+
+@interface.implementer(IMarker)
+class MarkedContainer(Container):
+    pass
+
+
+@interface.implementer(IMarker)
+class MarkedDict(dict):
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+
+class Moved(Container):
+    pass
+
+
+class Plain:
+
+    def __init__(self, name):
+        self.name = name
+
+
+class OtherPlain(Plain):
+    pass
+
+
+class TestFindObjectsMatching(unittest.TestCase):
+
+    def setUp(self):
+        from ZODB.MappingStorage import DB
+        self.db = DB()
+        self.conn = self.db.open()
+        self.root = self.conn.root()
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+
+    def _callFUT(self, root, condition=lambda obj: True, **kw):
+        from zope.generations.utility import findObjectsMatching
+        return [getattr(obj, 'name', None)
+                for obj in findObjectsMatching(root, condition, **kw)]
+
+    def test_deep_tree(self):
+        tree = top = {}
+        for i in range(5000):
+            top[i] = top = {}
+        self.assertEqual(len(self._callFUT(tree)), 5001)
+
+    def test_visited_once(self):
+        a = self.root['a'] = Container('a')
+        b = a['b'] = Container('b')
+        c = b['c'] = Container('c')
+        # c is contained twice and there's a cycle back to a.
+        a['c'] = c
+        c['a'] = a
+        transaction.commit()
+        transaction.begin()
+        self.assertEqual(self._callFUT(a), ['a', 'b', 'c'])
+
+    def test_prune(self):
+        a = self.root['a'] = Container('a')
+        b = a['b'] = Container('b')
+        b['c'] = Container('c')
+        a['d'] = Container('d')
+        self.assertEqual(self._callFUT(a, prune=lambda obj: obj is b),
+                         ['a', 'b', 'd'])
+
+    def test_budget(self):
+        a = self.root['a'] = Container('a')
+        for i in range(25):
+            a[i] = Container(i)
+        transaction.commit()
+        transaction.begin()
+
+        calls = []
+        cacheGC = self.conn.cacheGC
+        self.conn.cacheGC = lambda: calls.append(1) or cacheGC()
+        self.assertEqual(len(self._callFUT(a, budget=10)), 26)
+        self.assertEqual(len(calls), 2)
+
+        del calls[:]
+        self.assertEqual(len(self._callFUT(a, budget=None)), 26)
+        self.assertEqual(calls, [])
+
+    def test_prefetch(self):
+        a = self.root['a'] = Container('a')
+        for i in range(25):
+            a[i] = Container(i)
+            a[i]['x'] = {}
+        transaction.commit()
+        transaction.begin()
+        self.conn.cacheMinimize()
+
+        calls = []
+        self.conn.prefetch = lambda objs: calls.append(
+            [obj.name for obj in objs])
+        names = self._callFUT(a, prefetch=10)
+        self.assertEqual(names, ['a'] + [name for i in range(25)
+                                         for name in (i, None)])
+        # Only ghosts are prefetched.
+        self.assertEqual(calls, [list(range(0, 10)), list(range(10, 20)),
+                                 list(range(20, 25))])
+
+
+class TestFindObjectsInParallel(unittest.TestCase):
+
+    def setUp(self):
+        from ZODB.MappingStorage import DB
+        self.db = DB()
+        self.conn = self.db.open()
+        self.addCleanup(self.db.close)
+        self.addCleanup(self.conn.close)
+        self.addCleanup(transaction.abort)
+        with transaction.manager:
+            top = self.conn.root()['top'] = Container('top')
+            for i in range(10):
+                child = top[i] = Container('%d' % i)
+                for j in range(10):
+                    child[j] = MarkedContainer('%d.%d' % (i, j))
+                    # Non-persistent objects can't be reported.
+                    child[j]['x'] = MarkedDict('x')
+            # Shared objects are reported once.
+            top[3][10] = top[5][5]
+            # Objects that aren't in the database are searched directly.
+            top['new'] = MarkedDict('new')
+            top['new']['m'] = MarkedContainer('new.m')
+        transaction.begin()
+        self.top = self.conn.root()['top']
+
+    def test_matching(self):
+        from zope.generations.utility import findObjectsMatching
+        found = list(findObjectsMatching(
+            self.top, lambda obj: isinstance(obj, Container), workers=4))
+        self.assertTrue(all(obj._p_jar is self.conn for obj in found))
+        names = sorted(obj.name for obj in found)
+        self.assertEqual(len(names), 112)
+        self.assertEqual(names[:4], ['0', '0.0', '0.1', '0.2'])
+        self.assertIn('new.m', names)
+        self.assertNotIn('x', names)
+
+    def test_providing(self):
+        from zope.generations.utility import findObjectsProviding
+        names = {obj.name for obj in findObjectsProviding(
+            self.top, IMarker, workers=3, prune=lambda obj: obj.name == '7')}
+        # 90 containers plus 'new' and 'new.m'
+        self.assertEqual(len(names), 92)
+        self.assertNotIn('7.0', names)
+        self.assertNotIn('x', names)
+
+    def test_root_matches(self):
+        from zope.generations.utility import findObjectsMatching
+        found = list(findObjectsMatching(
+            self.top[1][1], lambda obj: True, workers=2))
+        self.assertEqual([obj.name for obj in found], ['1.1', 'x'])
+
+    def test_error_in_worker(self):
+        from zope.generations.utility import findObjectsMatching
+
+        def condition(obj):
+            if obj.name == '8.8':
+                raise ValueError(obj.name)
+            return False
+
+        with self.assertRaises(ValueError):
+            list(findObjectsMatching(self.top, condition, workers=2))
+
+    def test_stop_early(self):
+        from zope.generations.utility import findObjectsMatching
+        found = findObjectsMatching(self.top, lambda obj: True, workers=2)
+        self.assertEqual(next(found).name, 'top')
+        next(found)
+        found.close()
+
+    def test_needs_database(self):
+        from zope.generations.utility import findObjectsMatching
+        with self.assertRaises(ValueError):
+            list(findObjectsMatching({}, lambda obj: True, workers=2))
+
+
+class TestFindOidsByClass(unittest.TestCase):
+
+    def _check(self, db):
+        from zope.generations.utility import findOidsByClass
+        conn = db.open()
+        self.addCleanup(conn.close)
+        with transaction.manager:
+            top = conn.root()['top'] = Container('top')
+            for i in range(4):
+                top[i] = MarkedContainer(i)
+        transaction.begin()
+        self.addCleanup(transaction.abort)
+        oids = findOidsByClass(
+            db.storage, [__name__ + '.MarkedContainer'])
+        self.assertEqual(sorted(conn.get(oid).name for oid in oids),
+                         [0, 1, 2, 3])
+        oids = findOidsByClass(db.storage, __name__ + '.Container')
+        self.assertEqual([conn.get(oid) for oid in oids], [top])
+
+    def test_record_iteration(self):
+        from zope.generations.tests.test_generations import _makeFileStorageDB
+        self._check(_makeFileStorageDB(self))
+
+    def test_references(self):
+        from ZODB.MappingStorage import DB
+        db = DB()
+        self.addCleanup(db.close)
+        self._check(db)
+
+
+class TestFindObjectsProviding(unittest.TestCase):
+
+    def _callFUT(self, root, iface, **kw):
+        from zope.generations.utility import findObjectsProviding
+        return sorted(obj.name
+                      for obj in findObjectsProviding(root, iface, **kw))
+
+    def test_ghosts_providing_directly(self):
+        from ZODB.MappingStorage import DB
+        db = DB()
+        self.addCleanup(db.close)
+        conn = db.open()
+        self.addCleanup(conn.close)
+        with transaction.manager:
+            a = conn.root()['a'] = Container('a')
+            a['b'] = MarkedContainer('b')
+            a['c'] = Container('c')
+            a['d'] = Container('d')
+            interface.alsoProvides(a['c'], IMarker)
+
+        transaction.begin()
+        self.addCleanup(transaction.abort)
+        c = a['c']
+        conn.cacheMinimize()
+        self.assertEqual(c._p_changed, None)
+        self.assertEqual(self._callFUT(a, IMarker), ['b', 'c'])
+
+    def test_proxies(self):
+        from zope.location.interfaces import ILocation
+        from zope.location.location import LocationProxy
+        root = Container('root')
+        root['a'] = LocationProxy(Container('a'), root, 'a')
+        root['b'] = Container('b')
+        self.assertEqual(self._callFUT(root, ILocation), ['a'])
+
+
+class TestInBatches(unittest.TestCase):
+
+    def setUp(self):
+        from ZODB.MappingStorage import DB
+
+        from zope.generations.generations import Context
+        self.db = DB()
+        self.context = Context()
+        self.context.connection = self.conn = self.db.open()
+        transaction.begin()
+        self.root = self.conn.root()
+        for i in range(20):
+            self.root[i] = Container(i)
+        transaction.commit()
+        transaction.begin()
+
+    def tearDown(self):
+        transaction.abort()
+        self.conn.close()
+        self.db.close()
+
+    def _sizes(self, **kw):
+        from zope.generations.utility import inBatches
+        return [len(batch) for batch in inBatches(
+            self.context, self.root.values(), **kw)]
+
+    def test_growing(self):
+        self.assertEqual(self._sizes(size=1, target_time=60),
+                         [1, 2, 4, 8, 5])
+        self.assertEqual(self._sizes(size=1, target_time=60, max_size=3),
+                         [1, 2, 3, 3, 3, 3, 3, 2])
+
+    def test_shrinking(self):
+        self.assertEqual(self._sizes(size=8, target_time=0),
+                         [8, 4, 2, 1, 1, 1, 1, 1, 1])
+
+    def test_memory_limit(self):
+        self.assertEqual(
+            self._sizes(size=8, target_time=60, memory_limit=0),
+            [8, 4, 2, 1, 1, 1, 1, 1, 1])
+        self.assertEqual(
+            self._sizes(size=8, target_time=60, memory_limit=10 ** 9),
+            [8, 12])
+
+    def test_savepoint_and_cache(self):
+        from zope.generations.utility import inBatches
+        savepoints = []
+        for batch in inBatches(self.context, self.root.values(), size=5,
+                               target_time=0):
+            for obj in batch:
+                obj.name = 'evolved'
+                savepoints.append(obj._p_changed)
+        # The changes were moved out of the cache after each batch.
+        self.assertEqual(savepoints, [True] * 20)
+        self.assertTrue(all(obj._p_changed is None
+                            for obj in self.root.values()))
+        self.assertEqual({obj.name for obj in self.root.values()},
+                         {'evolved'})
+
+
+class TestRenameClasses(unittest.TestCase):
+
+    classes = {
+        __name__ + '.Moved': __name__ + '.Container',
+        __name__ + '.Plain': __name__ + '.OtherPlain',
+    }
+
+    def setUp(self):
+        from ZODB.MappingStorage import DB
+        self.db = DB()
+        self.addCleanup(self.db.close)
+
+    def test_rename(self):
+        from zope.generations.utility import renameClasses
+
+        with self.db.transaction() as conn:
+            a = conn.root()['a'] = Container('a')
+            a['m'] = Moved('m')
+            a['m']['plain'] = Plain('p')
+            a['m']['other'] = OtherPlain('o')
+            a['c'] = Container('c')
+            a['c']['plain'] = Plain('p')
+        # The root isn't changed, but the rest is.
+        self.assertEqual(renameClasses(self.db, self.classes), 3)
+        self.assertEqual(renameClasses(self.db, self.classes), 0)
+
+        with self.db.transaction() as conn:
+            a = conn.root()['a']
+            # The class of the ghost comes from the reference in a.
+            self.assertIs(type(a['m']), Container)
+            self.assertEqual(a['m']._p_changed, None)
+            self.assertEqual(a['m'].name, 'm')
+            self.assertIs(type(a['m']['plain']), OtherPlain)
+            self.assertIs(type(a['m']['other']), OtherPlain)
+            self.assertIs(type(a['c']['plain']), OtherPlain)
+            self.assertEqual(a['c']['plain'].name, 'p')
+
+    def test_batches(self):
+        from zope.generations.utility import renameClasses
+
+        with self.db.transaction() as conn:
+            for i in range(25):
+                conn.root()[i] = Moved(i)
+        descriptions = [t.description for t in self.db.storage.iterator()]
+        # 25 objects and the root, in batches of 10.
+        self.assertEqual(
+            renameClasses(self.db, self.classes, batch_size=10), 26)
+        self.assertEqual(
+            [t.description for t in self.db.storage.iterator()],
+            descriptions + [b'Renaming classes'] * 3)
+
+    def test_cached_objects(self):
+        from zope.generations.utility import renameClasses
+
+        conn = self.db.open()
+        self.addCleanup(conn.close)
+        with self.db.transaction() as other:
+            other.root()['plain'] = Plain('p')
+        transaction.begin()
+        self.assertIs(type(conn.root()['plain']), Plain)
+        renameClasses(self.db, self.classes)
+        # The connection sees the change from its next transaction on.
+        self.assertIs(type(conn.root()['plain']), Plain)
+        transaction.abort()
+        transaction.begin()
+        self.assertIs(type(conn.root()['plain']), OtherPlain)
+        transaction.abort()
+
+    def test_stack_global(self):
+        import pickle
+
+        from zope.generations.utility import _renamedRecord
+
+        # Protocol 4 memoizes the module name and uses it again.
+        data = pickle.dumps(Plain, 4) + pickle.dumps(
+            [Plain('a'), OtherPlain('b'), Plain('c')], 4)
+        renamed = _renamedRecord(data, self.classes)
+        f = io.BytesIO(renamed)
+        self.assertIs(pickle.load(f), OtherPlain)
+        self.assertEqual([(type(obj), obj.name) for obj in pickle.load(f)],
+                         [(OtherPlain, 'a'), (OtherPlain, 'b'),
+                          (OtherPlain, 'c')])
+        self.assertIsNone(_renamedRecord(
+            pickle.dumps(OtherPlain, 4) + pickle.dumps(None, 4),
+            self.classes))
@@ -13,9 +13,151 @@
 ##############################################################################
 """Utility functions for evolving database generations.
 """
+import concurrent.futures
+import io
+import itertools
+import pickletools
+import queue
+import threading
+import time
+
+import transaction
+
+from .generations import reportProgress
+
+
+_marker = object()
+
+
+def _prefetched(objects, window):
+    # Iterate over *objects*, asking the connections to prefetch the
+    # ghosts among the next *window* objects in bulk.
+    objects = iter(objects)
+    while True:
+        batch = list(itertools.islice(objects, window))
+        if not batch:
+            return
+        ghosts = {}
+        for obj in batch:
+            if getattr(obj, '_p_changed', False) is None:
+                ghosts.setdefault(obj._p_jar, []).append(obj)
+        for jar, objs in ghosts.items():
+            jar.prefetch(objs)
+        yield from batch
+
+
+def _searchPartitions(db, partitions, condition, prune, budget, prefetch,
+                      results, stop):
+    # Search the sub-trees whose oids are in the *partitions* queue using
+    # a connection of our own, putting the oids of matches in *results*.
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            return
+
+    def prune_or_stop(obj):
+        return stop.is_set() or (prune is not None and prune(obj))
+
+    tm = transaction.TransactionManager()
+    conn = db.open(tm)
+    try:
+        while not stop.is_set():
+            try:
+                oid = partitions.get_nowait()
+            except queue.Empty:
+                break
+            for obj in findObjectsMatching(conn.get(oid), condition,
+                                           prune_or_stop, budget, prefetch):
+                oid = getattr(obj, '_p_oid', None)
+                if oid is not None:
+                    put(oid)
+    finally:
+        tm.abort()
+        conn.close()
+        put(_marker)
+
+
+def _findObjectsInParallel(root, condition, prune, budget, prefetch,
+                           workers, total):
+    jar = getattr(root, '_p_jar', None)
+    if jar is None:
+        raise ValueError(
+            "Searching in parallel needs a root stored in the database",
+            root)
+    # The objects visited by all threads are counted, but only this
+    # thread can report the progress of the evolution step.
+    visited = [0]
+    if total is not None:
+        counter = itertools.count(1)
+        matches = condition
+
+        def condition(obj):
+            visited[0] = next(counter)
+            return matches(obj)
+
+    def report():
+        if total is not None:
+            reportProgress(visited[0], total)
 
-
-def findObjectsMatching(root, condition):
+    if condition(root):
+        yield root
+    if not hasattr(root, 'values') or (prune is not None and prune(root)):
+        return
+
+    seen = {root._p_oid}
+    partitions = queue.Queue()
+    local = []
+    for obj in root.values():
+        if getattr(obj, '_p_oid', None) is not None and obj._p_jar is jar:
+            partitions.put(obj._p_oid)
+        else:
+            local.append(obj)
+
+    results = queue.Queue(maxsize=1000)
+    stop = threading.Event()
+    executor = concurrent.futures.ThreadPoolExecutor(
+        workers, thread_name_prefix='zope.generations')
+    try:
+        futures = [
+            executor.submit(_searchPartitions, jar.db(), partitions,
+                            condition, prune, budget, prefetch, results,
+                            stop)
+            for _ in range(workers)]
+
+        # Objects we can't hand over to another connection are searched
+        # while the workers are busy.
+        for obj in local:
+            for found in findObjectsMatching(obj, condition, prune, budget,
+                                             prefetch):
+                oid = getattr(found, '_p_oid', None)
+                if oid is not None:
+                    if oid in seen:
+                        continue
+                    seen.add(oid)
+                yield found
+                report()
+
+        running = workers
+        while running:
+            oid = results.get()
+            if oid is _marker:
+                running -= 1
+            elif oid not in seen:
+                seen.add(oid)
+                yield jar.get(oid)
+            report()
+        for future in futures:
+            future.result()
+    finally:
+        stop.set()
+        executor.shutdown()
+
+
+def findObjectsMatching(root, condition, prune=None, budget=10000,
+                        prefetch=0, workers=1, total=None):
     """Find all objects in the root that match the condition.
 
     The condition is a callable Python object that takes an object as an
@@ -24,6 +166,37 @@ def findObjectsMatching(root, condition):
     All sub-objects of the root will also be searched recursively. All mapping
     objects providing ``values()`` are supported.
 
+    The tree is traversed depth-first without recursion, so deep trees
+    don't run into the recursion limit.  Persistent objects are visited
+    only once, even if they are contained in several containers or in a
+    cycle.  If *prune* is given, it is called for every object that
+    provides ``values()``; if it returns true, the sub-objects of this
+    object are not searched.  After every *budget* objects visited, the
+    caches of the connections involved are garbage collected, so that
+    ghosts loaded earlier don't use up all the memory.  Pass `None` to
+    turn this off.
+
+    If *prefetch* is a positive number, the sub-objects of a container
+    are taken in batches of this size, and the connection is asked to
+    prefetch the ghosts among them using ``Connection.prefetch``.  With
+    a storage like ZEO, this loads them with a few requests instead of
+    one per object.
+
+    If *workers* is greater than one, the sub-trees of the sub-objects
+    of *root* are searched concurrently by that many threads, each using
+    a connection of its own.  The objects found are then returned from
+    the connection of *root*, which must be stored in the database
+    already.  Note that the threads don't see changes not committed yet,
+    that *condition* (and *prune*) must be safe to call from several
+    threads, and that below the sub-objects of the root only persistent
+    objects can be found.  The order of the results isn't defined.
+
+    If *total*, an estimate of the number of objects to visit, is given,
+    the number of objects visited is reported as the progress of the
+    evolution step running, see
+    `zope.generations.generations.Context.progress`.  When searching in
+    parallel, it's reported as objects are found.
+
     Example:
 
     >>> class A(dict):
@@ -66,20 +239,63 @@ def findObjectsMatching(root, condition):
     >>> found = list(findObjectsMatching(root, lambda x: True))
     >>> found == [root]
     True
-    """
-
-    if condition(root):
-        yield root
 
-    if hasattr(root, 'values'):
-        for subobj in root.values():
-            yield from findObjectsMatching(subobj, condition)
+    We can skip parts of the tree, here everything below instances of B:
 
-
-def findObjectsProviding(root, interface):
+    >>> matches = findObjectsMatching(tree, lambda x: True,
+    ...                               prune=lambda x: isinstance(x, B))
+    >>> names = [x.name for x in matches]
+    >>> names.sort()
+    >>> names
+    ['a1', 'b1', 'c1']
+    """
+    if workers > 1:
+        yield from _findObjectsInParallel(root, condition, prune, budget,
+                                          prefetch, workers, total)
+        return
+
+    seen = set()
+    jars = set()
+    stack = [iter((root,))]
+    visited = 0
+    while stack:
+        obj = next(stack[-1], _marker)
+        if obj is _marker:
+            stack.pop()
+            continue
+
+        oid = getattr(obj, '_p_oid', None)
+        if oid is not None:
+            if oid in seen:
+                continue
+            seen.add(oid)
+            if obj._p_jar is not None:
+                jars.add(obj._p_jar)
+
+        if condition(obj):
+            yield obj
+
+        if hasattr(obj, 'values') and not (prune is not None and prune(obj)):
+            if prefetch:
+                stack.append(_prefetched(obj.values(), prefetch))
+            else:
+                stack.append(iter(obj.values()))
+
+        visited += 1
+        if budget and visited % budget == 0:
+            for jar in jars:
+                jar.cacheGC()
+        if total is not None:
+            reportProgress(visited, total)
+
+
+def findObjectsProviding(root, interface, prune=None, budget=10000,
+                         prefetch=0, workers=1, total=None):
     """Find all objects in the root that provide the specified interface.
 
     All sub-objects of the root will also be searched recursively.
+    *prune*, *budget*, *prefetch*, *workers* and *total* are passed to
+    `findObjectsMatching`.
 
     Example:
 
@@ -125,9 +341,370 @@ def findObjectsProviding(root, interface):
     >>> names.sort()
     >>> names
     ['a1', 'a2', 'a3', 'c1', 'c2']
+
+    Objects directly providing an interface are found as well:
+
+    >>> from zope.interface import alsoProvides
+    >>> alsoProvides(tree['b1']['b2']['c2'], IB)
+    >>> matches = findObjectsProviding(tree, IB)
+    >>> names = [x.name for x in matches]
+    >>> names.sort()
+    >>> names
+    ['b1', 'b2', 'c2']
     """
+    yield from findObjectsMatching(root, interface.providedBy, prune, budget,
+                                   prefetch, workers, total)
+
+
+def inBatches(context, objects, size=100, commit=False, target_time=1.0,
+              max_size=10000, memory_limit=None, total=None):
+    """Iterate over *objects* in batches, keeping the transaction small.
+
+    This yields lists of up to *size* objects taken from the iterable
+    *objects*.  After each batch was dealt with, the changes are moved
+    out of the object cache of the ``connection`` of *context* (see
+    `~zope.generations.generations.Context`).  This is done with an
+    optimistic savepoint, or, if *commit* is true, by committing using
+    ``context.checkpoint`` with the number of objects done.  Then the
+    cache is minimized.
+
+    When committing, an evolution step resumed after a failure skips
+    the objects done according to the last checkpoint, so *objects*
+    have to come in the same order every time.  The changes made
+    outside of the batches are committed with the first of them.
+
+    The size of the batches is adapted after each batch, so that a
+    batch takes about *target_time* seconds, savepoint or commit
+    included, but the size doubles or halves at most and doesn't exceed
+    *max_size*.  If *memory_limit* is given and the estimated size of
+    the objects in the cache exceeds that many bytes at the end of a
+    batch, the size is halved and won't grow past that again.
+
+    The objects done are reported as the progress of the step, with
+    *total* as the number of objects expected, see
+    `~zope.generations.generations.Context.progress`.
 
-    yield from findObjectsMatching(root, interface.providedBy)
+    Example:
+
+    >>> import transaction
+    >>> from persistent.mapping import PersistentMapping
+    >>> from ZODB.MappingStorage import DB
+    >>> from zope.generations.generations import Context
+    >>> db = DB()
+    >>> context = Context()
+    >>> context.connection = db.open()
+    >>> root = context.connection.root()
+    >>> tx = transaction.begin()
+    >>> for i in range(5):
+    ...     root[i] = PersistentMapping()
+
+    The first batch is done quickly, so the second may take all the
+    rest:
+
+    >>> for batch in inBatches(context, root.values(), size=2):
+    ...     print(len(batch))
+    ...     for obj in batch:
+    ...         obj['evolved'] = True
+    2
+    3
+    >>> all(obj['evolved'] for obj in root.values())
+    True
+
+    We'd better clean up:
+
+    >>> tx.abort()
+    >>> context.connection.close()
+    >>> db.close()
+    """
+    jar = context.connection
+    objects = iter(objects)
+    done = 0
+    if commit and isinstance(context.cursor, int):
+        done = context.cursor
+        for _ in itertools.islice(objects, done):
+            pass
+    while True:
+        started = time.monotonic()
+        batch = list(itertools.islice(objects, size))
+        if not batch:
+            return
+        yield batch
+        done += len(batch)
+        if commit:
+            context.checkpoint(done)
+        else:
+            transaction.savepoint(optimistic=True)
+        if (memory_limit is not None
+                and jar._cache.total_estimated_size > memory_limit):
+            size = max_size = max(size // 2, 1)
+        else:
+            elapsed = time.monotonic() - started
+            factor = target_time / elapsed if elapsed > 0 else 2
+            size = int(size * min(max(factor, 0.5), 2))
+            size = min(max(size, 1), max_size)
+        jar.cacheMinimize()
+        context.progress(done, total)
+
+
+def _currentRecords(storage):
+    # Iterate over ``(oid, tid, data)`` of the current object records.
+    from ZODB.POSException import POSKeyError
+    from ZODB.serialize import referencesf
+    from ZODB.utils import load_current
+    from ZODB.utils import z64
+
+    if hasattr(storage, 'record_iternext'):
+        next_oid = None
+        while True:
+            try:
+                oid, tid, data, next_oid = storage.record_iternext(next_oid)
+            except ValueError:
+                # The storage is empty.
+                return
+            if data is not None:
+                yield oid, tid, data
+            if next_oid is None:
+                return
+
+    # Without a way to iterate over the current records, we follow the
+    # references, starting at the root object.
+    seen = {z64}
+    stack = [z64]
+    while stack:
+        oid = stack.pop()
+        try:
+            data, tid = load_current(storage, oid)
+        except POSKeyError:
+            continue
+        yield oid, tid, data
+        for ref in referencesf(data):
+            if ref not in seen:
+                seen.add(ref)
+                stack.append(ref)
+
+
+def findOidsByClass(storage, class_names, total=None):
+    """Find the oids of the objects of the given classes in the storage.
+
+    Instead of loading objects, this looks at the current data records
+    of the *storage* and only reads the class reference at the start of
+    each record.  *class_names* is a dotted class name or a collection
+    of them.
+
+    Storages that support ``record_iternext``, like FileStorage and ZEO,
+    are scanned record by record; this includes objects that are no
+    longer reachable but weren't packed away yet.  For other storages,
+    the references between records are followed starting at the root
+    object.  The objects can be loaded using ``connection.get(oid)``.
+
+    If *total*, an estimate of the number of records, like
+    ``len(storage)``, is given, the number of records read is reported
+    as the progress of the evolution step running, see
+    `zope.generations.generations.Context.progress`.
+
+    Example:
+
+    >>> import transaction
+    >>> from persistent.list import PersistentList
+    >>> from persistent.mapping import PersistentMapping
+    >>> from ZODB.MappingStorage import DB
+    >>> db = DB()
+    >>> conn = db.open()
+    >>> tx = transaction.begin()
+    >>> conn.root()['list'] = PersistentList()
+    >>> conn.root()['mapping'] = mapping = PersistentMapping()
+    >>> mapping['list'] = PersistentList()
+    >>> tx.commit()
+
+    >>> oids = findOidsByClass(db.storage, 'persistent.list.PersistentList')
+    >>> sorted(conn.get(oid) is conn.root()['list'] for oid in oids)
+    [False, True]
+
+    >>> oids = findOidsByClass(db.storage, {
+    ...     'persistent.mapping.PersistentMapping', 'unknown.Class'})
+    >>> len(list(oids))
+    2
+
+    We'd better clean up:
+
+    >>> conn.close()
+    >>> db.close()
+    """
+    from ZODB.utils import get_pickle_metadata
+
+    if isinstance(class_names, str):
+        class_names = {class_names}
+    else:
+        class_names = set(class_names)
+
+    for done, (oid, tid, data) in enumerate(_currentRecords(storage), 1):
+        if '.'.join(get_pickle_metadata(data)) in class_names:
+            yield oid
+        if total is not None:
+            reportProgress(done, total)
+
+
+_strings = {'SHORT_BINUNICODE', 'BINUNICODE', 'BINUNICODE8', 'UNICODE',
+            'SHORT_BINSTRING', 'BINSTRING', 'STRING'}
+_puts = {'PUT', 'BINPUT', 'LONG_BINPUT'}
+_gets = {'GET', 'BINGET', 'LONG_BINGET'}
+
+
+def _renamedRecord(data, classes):
+    # Return the object record *data*, made of the class and the state
+    # pickles, with the classes referenced by name rewritten according
+    # to *classes*, or `None` if none of them is referenced.
+    chunks = []
+    copied = 0
+    f = io.BytesIO(data)
+    while f.tell() < len(data):
+        # The values pushed by the last opcodes and the strings in the
+        # memo, to know the arguments of STACK_GLOBAL opcodes.
+        pushed = []
+        memo = {}
+        for opcode, arg, pos in pickletools.genops(f):
+            name = opcode.name
+            if name == 'GLOBAL':
+                end = data.index(b'\n', data.index(b'\n', pos + 1) + 1) + 1
+                module, _, cls = data[pos + 1:end - 1].partition(b'\n')
+                new = classes.get(
+                    '{}.{}'.format(module.decode(), cls.decode()))
+                if new is not None:
+                    # Replace the opcode.
+                    chunks.append(data[copied:pos])
+                    chunks.append(_global(new))
+                    copied = end
+                pushed.append(None)
+            elif name == 'STACK_GLOBAL':
+                new = None
+                if len(pushed) > 1 and None not in pushed[-2:]:
+                    new = classes.get('.'.join(pushed[-2:]))
+                if new is not None:
+                    # Drop the name strings, which may be memoized and
+                    # used again, and push the new class instead.
+                    chunks.append(data[copied:pos])
+                    chunks.append(b'00' + _global(new))  # POP, POP
+                    copied = pos + 1
+                pushed.append(None)
+            elif name in _strings:
+                pushed.append(arg if isinstance(arg, str) else None)
+            elif name in _gets:
+                pushed.append(memo.get(arg))
+            elif name in _puts:
+                memo[arg] = pushed[-1] if pushed else None
+            elif name == 'MEMOIZE':
+                memo[len(memo)] = pushed[-1] if pushed else None
+            elif name != 'FRAME':
+                pushed.append(None)
+            del pushed[:-2]
+    if not chunks:
+        return None
+    chunks.append(data[copied:])
+    return b''.join(chunks)
+
+
+def _global(dotted_name):
+    module, name = dotted_name.rsplit('.', 1)
+    return b'c%s\n%s\n' % (module.encode(), name.encode())
+
+
+def _storeRecords(db, records, note, blobs=None):
+    # Write the *records* in a transaction of their own.  The storage
+    # instance used tells the connections of *db* about the changes.
+    # *blobs* maps oids to the blob files to store with their records.
+    from ZODB.Connection import TransactionMetaData
+    storage = db._mvcc_storage.new_instance()
+    txn = TransactionMetaData(description=note)
+    try:
+        storage.tpc_begin(txn)
+        try:
+            for oid, tid, data in records:
+                if blobs and oid in blobs:
+                    storage.storeBlob(oid, tid, data, blobs[oid], '', txn)
+                else:
+                    storage.store(oid, tid, data, '', txn)
+            storage.tpc_vote(txn)
+            storage.tpc_finish(txn)
+        except BaseException:
+            storage.tpc_abort(txn)
+            raise
+    finally:
+        storage.release()
+
+
+def renameClasses(db, classes, batch_size=1000, total=None):
+    """Change the classes of stored objects without loading them.
+
+    *classes* maps the dotted names of the classes to replace to the
+    dotted names of their replacements, for instance to evolve a
+    database after classes were moved to another module.  The current
+    object records of the storage of *db* are read one by one, see
+    `findOidsByClass`.  Wherever one of the classes is referenced by
+    name in a record, as the class of the object, in a persistent
+    reference or as the class of a non-persistent object in its state,
+    the reference is rewritten in the pickles.  No objects are created,
+    so neither the old nor the new classes need to be importable.  The
+    records changed are written directly to the storage in
+    transactions of *batch_size* records.  If *total*, an estimate of
+    the number of records, is given, the progress is reported as by
+    `findOidsByClass`.  This returns the number of records changed.
+
+    Only references to classes by name are rewritten; that's how ZODB
+    pickles classes.  The transactions are independent of the current
+    one: call this from an evolution step before changing objects, as
+    its connection sees the changes from its next transaction on, while
+    objects still referenced in memory keep their old class.  If
+    an object changes concurrently, ``ConflictError`` is raised; the
+    records written until then keep their changes and running the
+    function again is harmless.
+
+    Example, using the old name of `persistent.list.PersistentList`:
+
+    >>> from persistent.list import PersistentList
+    >>> from ZODB.MappingStorage import DB
+    >>> db = DB()
+    >>> with db.transaction() as conn:
+    ...     conn.root()['list'] = PersistentList([1])
+
+    Both the list and the root, which refers to it, are changed:
+
+    >>> renameClasses(db, {
+    ...     'persistent.list.PersistentList':
+    ...         'ZODB.PersistentList.PersistentList'})
+    2
+    >>> len(list(findOidsByClass(
+    ...     db.storage, 'ZODB.PersistentList.PersistentList')))
+    1
+    >>> with db.transaction() as conn:
+    ...     conn.root()['list']
+    [1]
+
+    We'd better clean up:
+
+    >>> db.close()
+    """
+    storage = db.storage
+    note = 'Renaming classes'
+    # Find the candidates by the bytes of the module names quickly.
+    needles = {name.rsplit('.', 1)[0].encode() for name in classes}
+    changed = 0
+    batch = []
+    records = _currentRecords(storage)
+    for done, (oid, tid, data) in enumerate(records, 1):
+        if any(needle in data for needle in needles):
+            new = _renamedRecord(data, classes)
+            if new is not None:
+                batch.append((oid, tid, new))
+                if len(batch) >= batch_size:
+                    _storeRecords(db, batch, note)
+                    changed += len(batch)
+                    batch = []
+        if total is not None:
+            reportProgress(done, total)
+    if batch:
+        _storeRecords(db, batch, note)
+        changed += len(batch)
+    return changed
 
 
 try: